@@ -9,34 +9,38 @@ Single source of truth for version from pyproject.toml.
 __license__ = "Apache-2.0"
 __author__ = "Allaun"
 
-# Version is read from installed package metadata
-try:
-    from importlib.metadata import version, PackageNotFoundError
-    __version__ = version("deduplab")
-except PackageNotFoundError:
-    # Package not installed, try reading from pyproject.toml
+
+def _resolve_version() -> str:
+    """Read version from installed package metadata, else pyproject.toml."""
     try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            return version("deduplab")
+        except PackageNotFoundError:
+            pass
+        
+        # Package not installed, try reading from pyproject.toml
         from pathlib import Path
-        import tomllib  # Python 3.11+
-        pyproject_path = Path(__file__).parent.parent / "pyproject.toml"
-        if pyproject_path.exists():
-            with open(pyproject_path, "rb") as f:
-                pyproject = tomllib.load(f)
-                __version__ = pyproject.get("project", {}).get("version", "unknown")
-        else:
-            __version__ = "unknown"
-    except ImportError:
-        # Python < 3.11, try tomli
         try:
-            import tomli
-            pyproject_path = Path(__file__).parent.parent / "pyproject.toml"
-            if pyproject_path.exists():
-                with open(pyproject_path, "rb") as f:
-                    pyproject = tomli.load(f)
-                    __version__ = pyproject.get("project", {}).get("version", "unknown")
-            else:
-                __version__ = "unknown"
+            import tomllib  # Python 3.11+
         except ImportError:
-            __version__ = "unknown"
-except Exception:
-    __version__ = "unknown"
\ No newline at end of file
+            import tomli as tomllib  # Python < 3.11
+        
+        pyproject_path = Path(__file__).parent.parent / "pyproject.toml"
+        if not pyproject_path.exists():
+            return "unknown"
+        with open(pyproject_path, "rb") as f:
+            pyproject = tomllib.load(f)
+        return pyproject.get("project", {}).get("version", "unknown")
+    except Exception:
+        return "unknown"
+
+
+def __getattr__(name):
+    # __version__ is resolved on first access (PEP 562) so importing the
+    # package does not pay for the metadata lookup or the TOML parse
+    if name == "__version__":
+        value = _resolve_version()
+        globals()["__version__"] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -2,41 +2,198 @@
 # Copyright (c) 2025 Allaun
 
 from __future__ import annotations
-import shutil
 import os
-import hashlib
+import re
+import errno
+import functools
 import time
-import json
 import sys
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, Mapping, Optional
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from .deps import check_dep
+from .jsonutil import dumps, loads
+from .hashing import CHUNK, new_sha256, fadvise, open_ro, hash_file
 
-CHUNK = 1024 * 1024  # 1MB chunks for I/O
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
+# Checkpoint manifest layout written by apply_moves
+CHECKPOINT_FORMAT = "deduplab_checkpoint_ndjson_v1"
 
-def _sha256_file(p: Path) -> str:
+# FICLONE ioctl from linux/fs.h (exposed as fcntl.FICLONE on Python 3.12+)
+_FICLONE = (
+    getattr(fcntl, "FICLONE", 0x40049409)
+    if fcntl is not None and sys.platform.startswith("linux") else None
+)
+
+# copy_file_range errnos meaning "not possible here", not an I/O failure
+_COPY_RANGE_UNSUPPORTED = frozenset({
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM
+})
+
+# Filesystems that checksum data blocks on write and verify them on read
+CHECKSUMMED_FS = frozenset({"btrfs", "zfs", "bcachefs"})
+
+# Octal escapes (\040 for space, ...) used in /proc/self/mountinfo paths
+_MOUNTINFO_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+@functools.lru_cache(maxsize=1)
+def select_verify_hash():
+    """
+    Resolve the Phase 2 hash once, on first use (not at import time).
+    
+    Phase 2 only checks that the copy matches what was read, it never
+    stores the digest, so a non-cryptographic hash (optional xxhash
+    package) is enough when available. Fingerprints recorded by the
+    scanner stay SHA-256.
+    
+    Returns:
+        Tuple of (hash constructor, backend name)
+    """
+    if check_dep("xxhash"):
+        import xxhash
+        return xxhash.xxh3_128, "xxh3_128"
+    return new_sha256, "sha256"
+
+
+def _try_reflink(s, d) -> bool:
+    """
+    Clone source extents into destination without copying data.
+    
+    Supported by Btrfs, XFS (reflink=1), bcachefs and OCFS2 when both
+    files live on the same filesystem.
+    
+    Args:
+        s: Source file object (open for reading)
+        d: Destination file object (open for writing, empty)
+    
+    Returns:
+        True if the clone succeeded, False if a byte copy is needed
     """
-    Compute SHA-256 hash of file.
+    if _FICLONE is None:
+        return False
+    try:
+        fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        return True
+    except OSError:
+        # EXDEV, EOPNOTSUPP, EINVAL... - not clonable here
+        return False
+
+
+def _copy_in_kernel(sfd: int, dfd: int) -> bool:
+    """
+    Copy the rest of sfd into dfd without passing bytes through userspace.
+    
+    Uses copy_file_range (Linux 4.5+, cross-filesystem since 5.3), which
+    NFS and some filesystems also offload server-side.
     
     Args:
-        p: Path to file
-        
+        sfd: Source file descriptor, at offset 0
+        dfd: Destination file descriptor, empty
+    
     Returns:
-        Lowercase hex digest (64 characters)
+        True if the whole file was copied, False if unsupported here
+        (nothing written; caller falls back to a userspace copy)
     """
-    h = hashlib.sha256()
-    with p.open("rb") as f:
-        for chunk in iter(lambda: f.read(CHUNK), b""):
-            h.update(chunk)
-    return h.hexdigest()
+    if not hasattr(os, "copy_file_range"):
+        return False
+    step = CHUNK * 64
+    first = True
+    while True:
+        try:
+            n = os.copy_file_range(sfd, dfd, step)
+        except OSError as e:
+            if first and e.errno in _COPY_RANGE_UNSUPPORTED:
+                return False
+            raise
+        if n == 0:
+            # Nothing copied from a non-empty source: procfs and some FUSE
+            # or network filesystems report EOF instead of an error
+            if first and os.fstat(sfd).st_size > 0:
+                return False
+            return True
+        first = False
 
 
-def copy_verify_delete(src: Path, dst: Path) -> int:
+@functools.lru_cache(maxsize=1)
+def _mount_table():
+    """
+    Read mount points and filesystem types from /proc/self/mountinfo.
+    
+    Returns:
+        List of (mount_point, fstype), longest mount point first.
+        Empty on platforms without mountinfo.
+    """
+    mounts = []
+    try:
+        with open("/proc/self/mountinfo", "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                fields = line.split()
+                sep = fields.index("-")
+                mount_point = _MOUNTINFO_ESCAPE.sub(
+                    lambda m: chr(int(m.group(1), 8)), fields[4]
+                )
+                mounts.append((mount_point, fields[sep + 1]))
+    except (OSError, ValueError, IndexError):
+        return []
+    mounts.sort(key=lambda m: len(m[0]), reverse=True)
+    return mounts
+
+
+def _fs_type(path: Path) -> str:
+    """Filesystem type holding `path` ('' if unknown)."""
+    real = os.path.realpath(path)
+    for mount_point, fstype in _mount_table():
+        if real == mount_point or real.startswith(mount_point.rstrip("/") + "/"):
+            return fstype
+    return ""
+
+
+def _needs_verify(dst_tmp: str, cloned: bool, verify=True) -> bool:
+    """
+    Decide whether Phase 2 must re-hash the destination.
+    
+    Args:
+        dst_tmp: Temporary destination file
+        cloned: True if Phase 1 used a reflink (extents shared, nothing copied)
+        verify: cfg["verify_after_copy"] - True skips the re-read on
+            checksummed filesystems, "always" never skips it, False
+            always skips it
+    
+    Returns:
+        True for a full hash comparison, False for size + first-block checks
+    """
+    if cloned or not verify:
+        return False
+    if verify == "always":
+        return True
+    return _fs_type(os.path.dirname(dst_tmp)) not in CHECKSUMMED_FS
+
+
+def _unlink_quiet(path: str):
+    """Remove a file if present, ignoring errors (temp-file cleanup)."""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def copy_verify_delete(src: Path, dst: Path, size: Optional[int] = None,
+                       verify=True, same_device: Optional[bool] = None) -> int:
     """
     Three-phase commit for safe file moves across devices.
     
-    Phase 1: Copy to temporary destination
-    Phase 2: Verify hash integrity
+    Same-filesystem moves are a single atomic rename (nothing is copied,
+    so there is nothing to verify). Otherwise, or if the rename reports
+    EXDEV (e.g. across bind mounts):
+    
+    Phase 1: Reflink or copy to temporary destination
+    Phase 2: Verify hash integrity (size check for reflinks and
+             checksummed filesystems, see _needs_verify)
     Phase 3: Atomic rename and delete source
     
     This ensures:
@@ -47,6 +204,10 @@ def copy_verify_delete(src: Path, dst: Path) -> int:
     Args:
         src: Source file path
         dst: Destination file path
+        size: Source size if the caller already stat'ed it
+        verify: Phase 2 policy, see _needs_verify
+        same_device: Whether src and dst's directory share st_dev, if the
+            caller already knows; None stats both here
         
     Returns:
         Number of bytes moved
@@ -54,58 +215,135 @@ def copy_verify_delete(src: Path, dst: Path) -> int:
     Raises:
         RuntimeError: If copy fails, verification fails, or cleanup fails
     """
-    # Generate temporary destination name
-    dst_tmp = dst.with_suffix(dst.suffix + '.tmp')
-    size = 0
+    # String forms once; os.* calls below skip pathlib dispatch
+    src_s = os.fspath(src)
+    dst_s = os.fspath(dst)
+    tmp_s = dst_s + ".tmp"
+    dst_dir = os.path.dirname(dst_s) or "."  # bare filename: current directory
     
     try:
         # Ensure destination directory exists
-        dst.parent.mkdir(parents=True, exist_ok=True)
+        os.makedirs(dst_dir, exist_ok=True)
         
         # Get source file size before copy
-        size = src.stat().st_size
+        if size is None or same_device is None:
+            st = os.stat(src_s)
+            size = st.st_size
+            if same_device is None:
+                same_device = st.st_dev == os.stat(dst_dir).st_dev
+        
+        # Same filesystem: rename moves no data and is atomic by itself
+        if same_device:
+            try:
+                os.rename(src_s, dst_s)
+                return size
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise RuntimeError(f"Rename failed: {src} → {dst}: {e}")
+        
+        # Whether Phase 2 will compare full hashes if the copy is not a clone
+        hash_inline = _needs_verify(tmp_s, False, verify)
         
-        # PHASE 1: Copy to temporary file
+        # PHASE 1: Reflink when the filesystem supports it. Otherwise copy
+        # to temporary file: in the kernel when no full hash is needed,
+        # else through userspace, hashing source bytes in-flight so the
+        # source is read only once
+        verify_ctor = select_verify_hash()[0]
+        h_src = verify_ctor()
+        head_hash = None  # digest of the first chunk, for the cheap check
+        cloned = False
         try:
-            with src.open("rb") as s, dst_tmp.open("wb") as d:
-                shutil.copyfileobj(s, d, length=CHUNK)
+            with open(open_ro(src_s), "rb") as s, open(tmp_s, "wb") as d:
+                cloned = _try_reflink(s, d)
+                copied = cloned
+                if not cloned:
+                    fadvise(s.fileno(), "SEQUENTIAL")
+                if not copied and not hash_inline:
+                    copied = _copy_in_kernel(s.fileno(), d.fileno())
+                    if copied:
+                        head_hash = verify_ctor(os.pread(s.fileno(), CHUNK, 0)).digest()
+                while not copied:
+                    buf = s.read(CHUNK)
+                    if not buf:
+                        break
+                    if head_hash is None:
+                        head_hash = verify_ctor(buf).digest()
+                    h_src.update(buf)
+                    d.write(buf)
+                if not cloned:
+                    # Source is not read again; release its pages
+                    fadvise(s.fileno(), "DONTNEED")
         except Exception as e:
-            raise RuntimeError(f"Copy failed: {src} → {dst_tmp}: {e}")
+            raise RuntimeError(f"Copy failed: {src} → {tmp_s}: {e}")
+        
+        full_verify = hash_inline and not cloned
         
         # Force fsync to ensure data is on disk
         try:
-            with dst_tmp.open("rb+") as f:
-                f.flush()
-                os.fsync(f.fileno())
+            fd = os.open(tmp_s, os.O_RDWR)
+            try:
+                os.fsync(fd)
+                if not full_verify:
+                    # Pages are clean after fsync and only the first chunk is
+                    # re-read below; a full verify drops them in hash_file
+                    fadvise(fd, "DONTNEED")
+            finally:
+                os.close(fd)
         except Exception as e:
-            dst_tmp.unlink(missing_ok=True)
-            raise RuntimeError(f"Fsync failed for {dst_tmp}: {e}")
-        
-        # PHASE 2: Verify hash integrity
-        src_hash = _sha256_file(src)
-        dst_hash = _sha256_file(dst_tmp)
-        
-        if src_hash != dst_hash:
-            # Verification failed - cleanup temp file
-            dst_tmp.unlink(missing_ok=True)
-            raise RuntimeError(
-                f"Hash mismatch after copy:\n"
-                f"  Source: {src} ({src_hash})\n"
-                f"  Dest:   {dst_tmp} ({dst_hash})"
-            )
+            _unlink_quiet(tmp_s)
+            raise RuntimeError(f"Fsync failed for {tmp_s}: {e}")
+        
+        # PHASE 2: Verify integrity
+        if not full_verify:
+            # Reflink shares the source extents, or the filesystem checksums
+            # every block: confirm the size, and the first chunk for copies
+            dst_size = os.stat(tmp_s).st_size
+            if dst_size != size:
+                _unlink_quiet(tmp_s)
+                raise RuntimeError(
+                    f"Size mismatch after copy:\n"
+                    f"  Source: {src} ({size} bytes)\n"
+                    f"  Dest:   {tmp_s} ({dst_size} bytes)"
+                )
+            
+            if head_hash is not None:
+                fd = open_ro(tmp_s)
+                try:
+                    head = os.read(fd, CHUNK)
+                finally:
+                    os.close(fd)
+                if verify_ctor(head).digest() != head_hash:
+                    _unlink_quiet(tmp_s)
+                    raise RuntimeError(
+                        f"First block mismatch after copy: {src} → {tmp_s}"
+                    )
+        else:
+            # Destination re-read from disk
+            src_hash = h_src.hexdigest()
+            dst_hash = hash_file(tmp_s, verify_ctor, drop_cache=True, use_mmap=True)
+            
+            if src_hash != dst_hash:
+                # Verification failed - cleanup temp file
+                _unlink_quiet(tmp_s)
+                raise RuntimeError(
+                    f"Hash mismatch after copy:\n"
+                    f"  Source: {src} ({src_hash})\n"
+                    f"  Dest:   {tmp_s} ({dst_hash})"
+                )
         
         # PHASE 3: Commit - atomic rename then delete source
         try:
-            # Atomic rename (on same filesystem this is guaranteed atomic)
-            dst_tmp.rename(dst)
+            # Atomic rename (on same filesystem this is guaranteed atomic,
+            # and os.replace also overwrites atomically on Windows)
+            os.replace(tmp_s, dst_s)
         except Exception as e:
             # Rename failed - cleanup temp file
-            dst_tmp.unlink(missing_ok=True)
-            raise RuntimeError(f"Atomic rename failed: {dst_tmp} → {dst}: {e}")
+            _unlink_quiet(tmp_s)
+            raise RuntimeError(f"Atomic rename failed: {tmp_s} → {dst}: {e}")
         
         # Now safe to delete source (destination is verified and committed)
         try:
-            src.unlink()
+            os.unlink(src_s)
         except Exception as e:
             # Source deletion failed, but destination is safe
             # Log warning but don't raise - user can manually delete source
@@ -117,24 +355,28 @@ def copy_verify_delete(src: Path, dst: Path) -> int:
         return size
         
     except Exception as e:
-        # Ensure no temporary files are left behind
-        if dst_tmp.exists():
-            try:
-                dst_tmp.unlink()
-            except:
-                pass  # Best effort cleanup
+        # Ensure no temporary files are left behind (best effort)
+        _unlink_quiet(tmp_s)
         raise
 
 
-def apply_moves(rows: List[Dict[str, str]], checkpoint: Path, dry_run: bool) -> Dict[str, int]:
+def apply_moves(rows: Iterable[Mapping[str, str]], checkpoint: Path, dry_run: bool,
+                workers: int = 1, verify=True) -> Dict[str, int]:
     """
     Apply planned file moves with checkpoint creation.
     
+    Moves run on a thread pool (hashing and file I/O release the GIL).
+    Source checks and destination conflict resolution stay on the calling
+    thread, so two rows never race for the same destination name.
+    
     Args:
-        rows: List of plan records from CSV (must have 'op', 'status', 'src_path', 'dst_path')
-        checkpoint: Path to write checkpoint manifest
+        rows: Plan records, e.g. a csv.DictReader (must have 'op', 'status', 'src_path', 'dst_path')
+        checkpoint: Path to write checkpoint manifest (NDJSON, see
+            iter_checkpoint_moves)
         dry_run: If True, simulate moves without actual filesystem changes
-        
+        workers: Number of concurrent moves (dry runs are always serial)
+        verify: Post-copy verification policy (cfg["verify_after_copy"])
+    
     Returns:
         Dictionary with execution statistics:
         {
@@ -148,94 +390,182 @@ def apply_moves(rows: List[Dict[str, str]], checkpoint: Path, dry_run: bool) ->
     """
     from .planner import ensure_unique
     
-    applied = []
     attempted = 0
+    succeeded = 0
     skipped = 0
     errors = 0
     bytes_moved = 0
+    workers = max(1, workers)
+    max_inflight = workers * 4  # Bounds memory when rows is a stream
+    futs = {}      # future -> (submission index, src, dst)
+    inflight = {}  # dst -> future still writing it
+    dir_devs = {}  # destination parent -> st_dev, created once per run
     
-    for row in rows:
-        # Only process 'move' operations that are 'planned'
-        if row.get("op") != "move" or row.get("status") != "planned":
-            continue
-        
-        src = Path(row["src_path"])
-        dst = Path(row["dst_path"])
-        attempted += 1
+    def _collect(fut):
+        nonlocal succeeded, errors, bytes_moved
+        index, src, dst = futs.pop(fut)
+        if inflight.get(dst) is fut:
+            del inflight[dst]
         
         try:
-            # Skip if source doesn't exist
-            if not src.exists():
-                skipped += 1
-                print(f"[applier][WARN] Source not found: {src}", file=sys.stderr)
-                continue
-            
-            # Ensure destination directory exists
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            
-            # Handle destination conflicts
-            if dst.exists():
-                original_dst = dst
-                dst = ensure_unique(dst)
-                print(
-                    f"[applier][INFO] Destination exists, using unique name:\n"
-                    f"  Original: {original_dst}\n"
-                    f"  New:      {dst}",
-                    file=sys.stderr
-                )
-            
-            if dry_run:
-                # Simulate move
-                size = src.stat().st_size
-                print(f"[applier][DRY-RUN] Would move: {src} → {dst} ({size} bytes)")
-            else:
-                # Execute actual move
-                size = copy_verify_delete(src, dst)
-                bytes_moved += size
-                
-                # Record successful move
-                applied.append({
-                    "src": str(src),
-                    "dst": str(dst),
-                    "size": size,
-                    "timestamp": time.time()
-                })
-                
-                print(f"[applier][OK] Moved: {src} → {dst} ({size} bytes)")
-                
+            size = fut.result()
         except Exception as e:
             errors += 1
             print(
                 f"[applier][ERROR] Failed to move {src} → {dst}: {e}",
                 file=sys.stderr
             )
+            return
+        
+        succeeded += 1
+        bytes_moved += size
+        
+        # Record successful move as soon as it is committed
+        cp_file.write(dumps({
+            "index": index,
+            "src": str(src),
+            "dst": str(dst),
+            "size": size,
+            "timestamp": time.time()
+        }) + b"\n")
+        
+        print(f"[applier][OK] Moved: {src} → {dst} ({size} bytes)")
     
-    # Write checkpoint manifest
+    # Checkpoint is NDJSON: header line, one line per committed move,
+    # footer line with statistics. Unbuffered writes (one per line) keep
+    # it usable for rollback even if the run is interrupted.
     checkpoint.parent.mkdir(parents=True, exist_ok=True)
     
-    manifest = {
-        "timestamp": time.time(),
-        "dry_run": dry_run,
-        "statistics": {
-            "attempted": attempted,
-            "succeeded": len(applied),
-            "skipped": skipped,
-            "errors": errors,
-            "bytes_moved": bytes_moved
-        },
-        "moves": applied
-    }
-    
-    checkpoint.write_text(
-        json.dumps(manifest, indent=2, ensure_ascii=False),
-        encoding="utf-8"
-    )
+    with checkpoint.open("wb", buffering=0) as cp_file:
+        cp_file.write(dumps({
+            "header": {"timestamp": time.time(), "format": CHECKPOINT_FORMAT},
+            "dry_run": dry_run
+        }) + b"\n")
+        
+        # Resolve (and possibly install) xxhash before moves run on threads
+        select_verify_hash()
+        
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for row in rows:
+                # Only process 'move' operations that are 'planned'
+                if row.get("op") != "move" or row.get("status") != "planned":
+                    continue
+            
+                src = Path(row["src_path"])
+                dst = Path(row["dst_path"])
+                attempted += 1
+            
+                try:
+                    # Skip if source doesn't exist (one stat serves both checks)
+                    try:
+                        st = os.stat(src)
+                    except FileNotFoundError:
+                        skipped += 1
+                        print(f"[applier][WARN] Source not found: {src}", file=sys.stderr)
+                        continue
+                
+                    size = st.st_size
+                    
+                    # Ensure destination directory exists (once per directory)
+                    dst_dev = dir_devs.get(dst.parent)
+                    if dst_dev is None:
+                        dst.parent.mkdir(parents=True, exist_ok=True)
+                        dst_dev = dir_devs[dst.parent] = os.stat(dst.parent).st_dev
+                
+                    # Handle destination conflicts (including moves still in flight)
+                    original_dst = dst
+                    while True:
+                        pending = inflight.get(dst)
+                        if pending is not None:
+                            wait([pending])
+                        if not os.path.lexists(dst):
+                            break
+                        dst = ensure_unique(dst)
+                
+                    if dst != original_dst:
+                        print(
+                            f"[applier][INFO] Destination exists, using unique name:\n"
+                            f"  Original: {original_dst}\n"
+                            f"  New:      {dst}",
+                            file=sys.stderr
+                        )
+                    
+                    if dry_run:
+                        # Simulate move
+                        print(f"[applier][DRY-RUN] Would move: {src} → {dst} ({size} bytes)")
+                    else:
+                        # Execute actual move
+                        fut = ex.submit(copy_verify_delete, src, dst, size, verify,
+                                        st.st_dev == dst_dev)
+                        futs[fut] = (attempted, src, dst)
+                        inflight[dst] = fut
+                
+                except Exception as e:
+                    errors += 1
+                    print(
+                        f"[applier][ERROR] Failed to move {src} → {dst}: {e}",
+                        file=sys.stderr
+                    )
+            
+                # Keep reading the plan only while the pool has room
+                if len(futs) >= max_inflight:
+                    done, _ = wait(list(futs), return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        _collect(fut)
+        
+            for fut in as_completed(list(futs)):
+                _collect(fut)
+        
+        cp_file.write(dumps({
+            "footer": {
+                "timestamp": time.time(),
+                "attempted": attempted,
+                "succeeded": succeeded,
+                "skipped": skipped,
+                "errors": errors,
+                "bytes_moved": bytes_moved
+            }
+        }) + b"\n")
     
     return {
         "attempted": attempted,
-        "succeeded": len(applied),
+        "succeeded": succeeded,
         "skipped": skipped,
         "errors": errors,
         "bytes_moved": bytes_moved,
         "dry_run": dry_run
-    }
\ No newline at end of file
+    }
+
+
+def iter_checkpoint_moves(checkpoint: Path) -> Iterator[Dict]:
+    """
+    Yield recorded moves from a checkpoint, one at a time.
+    
+    Reads the NDJSON format written by apply_moves line by line, and
+    falls back to loading legacy single-document JSON checkpoints.
+    
+    Args:
+        checkpoint: Path to checkpoint manifest
+    
+    Yields:
+        Move records with 'src', 'dst', 'size', 'timestamp'
+    """
+    with checkpoint.open("rb") as f:
+        first = f.readline()
+        try:
+            header = loads(first)
+        except ValueError:
+            header = None
+        
+        if not (isinstance(header, dict) and "header" in header):
+            # Legacy checkpoint: one indented JSON document
+            f.seek(0)
+            yield from loads(f.read()).get("moves", [])
+            return
+        
+        for line in f:
+            if not line.strip():
+                continue
+            rec = loads(line)
+            if "footer" not in rec:
+                yield rec
\ No newline at end of file
@@ -2,7 +2,7 @@
 # Copyright (c) 2025 Allaun
 
 import argparse
-import json
+import os
 import sys
 import time
 import csv
@@ -10,20 +10,35 @@ import atexit
 from pathlib import Path
 from datetime import datetime
 from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from .config import load_config
 from .db import DB
-from .scanner import threaded_hash
+from .scanner import threaded_hash_stream, compile_ignore
 from .meta_exporter import write_folder_meta
-from .accelerator import DataFrameWrapper
 from .planner import ensure_unique, write_plan_csv
-from .applier import apply_moves
+from .applier import apply_moves, iter_checkpoint_moves, select_verify_hash
+from .hashing import select_content_hash
 from .rollback import rollback_from_checkpoint
 from .logger import JsonlLogger
 from .metrics import Metrics
-from .bootstrap import lint_tree
 from .deps import init_deps
-from . import __version__
+from .jsonutil import dumps
+
+
+class _VersionAction(argparse.Action):
+    """--version that only resolves the package version when requested."""
+    
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+                 help="show program's version number and exit"):
+        super().__init__(option_strings=option_strings, dest=dest,
+                         default=default, nargs=0, help=help)
+    
+    def __call__(self, parser, namespace, values, option_string=None):
+        from . import __version__
+        parser.exit(message=f"{parser.prog} {__version__}\n")
 
 
 def _iso_now():
@@ -43,41 +58,70 @@ def cmd_scan(args, cfg):
         keep=cfg["logging"]["keep"]
     )
     metrics = Metrics(Path(cfg["metrics_path"]))
+    hash_fn, hash_backend = select_content_hash(cfg.get("hash_algo", "sha256"))
+    
+    # meta.json entries carry a "sha256" field, so only export it when the
+    # content hash actually is SHA-256
+    export_meta = cfg.get("export_folder_meta", False)
+    if export_meta and hash_backend == "blake3":
+        logger.log("WARN", "meta_export_disabled", reason="hash_algo=blake3")
+        export_meta = False
     
     # Log scan start
     logger.log("INFO", "scan_start", 
                roots=list(args.root), 
                parallelism=cfg["parallelism"],
-               export_meta=cfg.get("export_folder_meta", False))
+               hash_backend=hash_backend,
+               export_meta=export_meta)
+    
+    # meta.json entries need a real sha256 for every file, so the size
+    # prefilter only applies when meta export is off
+    size_prefilter = cfg.get("size_prefilter", False)
+    if size_prefilter and export_meta:
+        logger.log("WARN", "size_prefilter_disabled", reason="export_folder_meta")
+        size_prefilter = False
+    
+    # Digests from earlier scans of unchanged files
+    hash_cache = None
+    if cfg.get("hash_cache", True):
+        hash_cache = db.load_hash_cache("blake3" if hash_backend == "blake3" else "sha256")
     
     # Execute scan
-    records, dur, total = threaded_hash(
+    scan_stats = {}
+    records = threaded_hash_stream(
         args.root, 
-        cfg["ignore_patterns"], 
-        workers=cfg["parallelism"]
+        compile_ignore(cfg["ignore_patterns"]), 
+        workers=cfg["parallelism"],
+        size_prefilter=size_prefilter,
+        partial_prefilter=cfg.get("partial_prefilter", False),
+        hash_fn=hash_fn,
+        use_processes=cfg.get("hash_processes", False),
+        hash_cache=hash_cache,
+        stats=scan_stats,
+        db=db
     )
     
+    # Meta export groups records by directory, so it needs them all;
+    # otherwise they stream straight into the database
+    if export_meta:
+        records = list(records)
+    
     # Store in database
     db.upsert_files(records)
+    if hash_cache is not None:
+        db.save_hash_cache(hash_cache, args.root)
     
-    # Calculate metrics
-    dfw = DataFrameWrapper([{
-        "path": r[0], 
-        "size": r[1], 
-        "mtime": r[2], 
-        "sha256": r[3], 
-        "mime": r[4],
-        "context_tag": r[5]
-    } for r in records])
-    
-    bytes_scanned = dfw.sum("size")
+    # Filled in by the stream once it is exhausted
+    total = scan_stats["files"]
+    bytes_scanned = scan_stats["bytes"]
+    dur = scan_stats["duration"]
     
     metrics.data["files_scanned"] = total
     metrics.data["bytes_scanned"] = int(bytes_scanned)
     metrics.data["durations"]["scan_s"] = round(dur, 3)
     
     # META EXPORT INTEGRATION
-    if cfg.get("export_folder_meta", False):
+    if export_meta:
         logger.log("INFO", "meta_export_start", directories="calculating")
         
         # Group files by directory
@@ -102,21 +146,31 @@ def cmd_scan(args, cfg):
         meta_count = 0
         meta_errors = 0
         
-        for dir_path, file_recs in by_dir.items():
-            try:
-                write_folder_meta(
-                    folder_path=dir_path,
-                    file_records=file_recs,
-                    root_path=Path(args.root[0]),
-                    pretty=cfg.get("meta_pretty", False),
-                    silent=True
-                )
-                meta_count += 1
-            except Exception as e:
-                meta_errors += 1
-                logger.log("ERROR", "meta_export_failed", 
-                          directory=str(dir_path), 
-                          error=str(e))
+        # Directories are independent and serialization is CPU-bound, so
+        # spread them over processes (workers never pip-install or print)
+        root_path = Path(args.root[0])
+        pretty = cfg.get("meta_pretty", False)
+        
+        with ProcessPoolExecutor(
+            max_workers=cfg.get("parallelism") or os.cpu_count() or 1,
+            initializer=init_deps,
+            initargs=(False, True)
+        ) as ex:
+            futs = {
+                ex.submit(write_folder_meta, dir_path, file_recs,
+                          root_path, pretty, True): dir_path
+                for dir_path, file_recs in by_dir.items()
+            }
+            
+            for fut in as_completed(futs):
+                try:
+                    fut.result()
+                    meta_count += 1
+                except Exception as e:
+                    meta_errors += 1
+                    logger.log("ERROR", "meta_export_failed", 
+                              directory=str(futs[fut]), 
+                              error=str(e))
         
         metrics.data["meta_exported"] = meta_count
         metrics.data["meta_errors"] = meta_errors
@@ -137,7 +191,7 @@ def cmd_scan(args, cfg):
     # Console output
     print(f"[scan] files={total} bytes={bytes_scanned} dur_s={round(dur,3)} → {cfg['db_path']}")
     
-    if cfg.get("export_folder_meta", False):
+    if export_meta:
         print(f"[scan] meta.json exported to {metrics.data.get('meta_exported', 0)} directories")
     
     return 0
@@ -153,13 +207,16 @@ def cmd_plan(args, cfg):
     )
     metrics = Metrics(Path(cfg["metrics_path"]))
 
-    dups = db.get_duplicates()
     ts = _iso_now()
     rows = []
     rbk = 0
+    groups = 0
     
-    for sha, context_tag, paths_csv in dups:
-        paths = sorted(paths_csv.split("|"))
+    # Rows arrive ordered by (sha256, context_tag, path): the first path of
+    # each group is the keeper
+    for (sha, context_tag), grp in groupby(db.get_duplicate_rows(), key=itemgetter(0, 1)):
+        groups += 1
+        paths = [r[2] for r in grp]
         keeper = paths[0]
         
         for src in paths[1:]:
@@ -180,12 +237,12 @@ def cmd_plan(args, cfg):
             rbk += 1
     
     write_plan_csv(rows, Path(args.out))
-    metrics.data["duplicates_found"] = len(dups)
+    metrics.data["duplicates_found"] = groups
     metrics.data["planned_ops"] = len(rows)
     metrics.save()
     
-    logger.log("INFO", "plan_done", duplicates=len(dups), planned=len(rows), out=str(args.out))
-    print(f"[plan] duplicate_groups={len(dups)} planned_ops={len(rows)} → {args.out}")
+    logger.log("INFO", "plan_done", duplicates=groups, planned=len(rows), out=str(args.out))
+    print(f"[plan] duplicate_groups={groups} planned_ops={len(rows)} → {args.out}")
     return 0
 
 
@@ -198,19 +255,23 @@ def cmd_apply(args, cfg):
     )
     metrics = Metrics(Path(cfg["metrics_path"]))
 
-    rows = []
-    with Path(args.plan).open("r", encoding="utf-8", newline="") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            rows.append(row)
-
     dry = cfg["dry_run"] and (not args.force)
-    res = apply_moves(rows, Path(args.checkpoint), dry_run=dry)
+    
+    # Stream plan rows straight from disk into the applier
+    with Path(args.plan).open("r", encoding="utf-8", newline="") as f:
+        res = apply_moves(
+            csv.DictReader(f),
+            Path(args.checkpoint),
+            dry_run=dry,
+            workers=cfg.get("parallelism") or os.cpu_count() or 1,
+            verify=cfg.get("verify_after_copy", True)
+        )
     
     metrics.data["apply"].update(res)
     metrics.save()
 
-    logger.log("INFO", "apply_done", **res, dry_run=dry, checkpoint=str(args.checkpoint))
+    logger.log("INFO", "apply_done", **res, dry_run=dry, checkpoint=str(args.checkpoint),
+               verify_hash=select_verify_hash()[1])
     print(f"[apply] {res} dry_run={dry} checkpoint={args.checkpoint}")
     
     return 0 if res["errors"] == 0 else 5
@@ -230,16 +291,16 @@ def cmd_verify(args, cfg):
         print(f"[verify] checkpoint not found: {cp}")
         return 5
     
-    manifest = json.loads(cp.read_text(encoding="utf-8"))
-    moves = manifest.get("moves", [])
+    checked = 0
     missing = []
     
-    for mv in moves:
-        if not Path(mv["dst"]).exists():
+    for mv in iter_checkpoint_moves(cp):
+        checked += 1
+        if not os.path.exists(mv["dst"]):
             missing.append(mv["dst"])
     
-    result = {"checked": len(moves), "missing": missing}
-    print(json.dumps(result, indent=2))
+    result = {"checked": checked, "missing": missing}
+    print(dumps(result, pretty=True).decode("utf-8"))
     
     return 0 if not missing else 5
 
@@ -254,36 +315,57 @@ def cmd_metrics(args, cfg):
     return 0
 
 
-def main(argv=None):
-    """
-    Main entry point with complete startup/shutdown linting.
+def cmd_self_check(args, cfg):
+    """Self-check command - lint the package's own Python files."""
+    from .bootstrap import lint_tree
     
-    Process:
-    1. Initialize dependency manager
-    2. Lint Python files at startup
-    3. Register shutdown linting via atexit
-    4. Load configuration
-    5. Parse arguments and execute command
-    """
-    # Initialize dependency auto-installer
-    dep_mgr = init_deps(auto_install=True, silent=False)
-    
-    # Startup linting
     module_dir = Path(__file__).parent
     try:
         lint_tree(module_dir)
     except SyntaxError as e:
-        print(f"[fatal] Startup linting failed: {e}", file=sys.stderr)
+        print(f"[self-check] failed: {e}", file=sys.stderr)
         return 10
+    print(f"[self-check] ok: {module_dir}")
+    return 0
+
+
+def main(argv=None):
+    """
+    Main entry point.
+    
+    Process:
+    1. Initialize dependency manager (pip auto-install only if
+       DEDUPLAB_AUTOINSTALL is set)
+    2. Lint Python files at startup and shutdown (only if DEDUPLAB_LINT
+       is set; a developer check, not needed at runtime)
+    3. Load configuration
+    4. Parse arguments and execute command
+    """
+    # Initialize dependency manager
+    dep_mgr = init_deps(
+        auto_install=bool(os.environ.get("DEDUPLAB_AUTOINSTALL")),
+        silent=False
+    )
     
-    # Register shutdown linting
-    def shutdown_lint():
+    if os.environ.get("DEDUPLAB_LINT"):
+        from .bootstrap import lint_tree
+        
+        # Startup linting
+        module_dir = Path(__file__).parent
         try:
             lint_tree(module_dir)
-        except Exception as e:
-            print(f"[warn] Shutdown linting failed: {e}", file=sys.stderr)
-    
-    atexit.register(shutdown_lint)
+        except SyntaxError as e:
+            print(f"[fatal] Startup linting failed: {e}", file=sys.stderr)
+            return 10
+        
+        # Register shutdown linting
+        def shutdown_lint():
+            try:
+                lint_tree(module_dir)
+            except Exception as e:
+                print(f"[warn] Shutdown linting failed: {e}", file=sys.stderr)
+        
+        atexit.register(shutdown_lint)
     
     # Load configuration
     cfg = load_config()
@@ -293,7 +375,7 @@ def main(argv=None):
         prog="deduplab",
         description="Context-aware file deduplication and organization system"
     )
-    parser.add_argument('--version', action='version', version=f'%(prog)s {__version__}')
+    parser.add_argument('--version', action=_VersionAction)
     
     sub = parser.add_subparsers(dest="cmd", required=True)
 
@@ -332,6 +414,10 @@ def main(argv=None):
     p_mt = sub.add_parser("metrics", help="Display last run metrics")
     p_mt.set_defaults(_run=cmd_metrics)
 
+    # Self-check command
+    p_sc = sub.add_parser("self-check", help="Lint the installed package sources")
+    p_sc.set_defaults(_run=cmd_self_check)
+    
     # Parse and execute
     args = parser.parse_args(argv)
     
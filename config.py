@@ -4,13 +4,23 @@
 import yaml
 from pathlib import Path
 
+try:
+    from yaml import CSafeLoader as _Loader  # libyaml C parser
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
 DEFAULTS = {
-    "hash_algo": "sha256",
+    "hash_algo": "sha256",  # or "blake3" (optional package; disables meta export)
     "dedup_strategy": "content_hash",
     "parallelism": 0,  # 0 = auto-detect
     "dry_run": True,
     "overwrite": False,
     "checkpoint": True,
+    "verify_after_copy": True,  # True = auto (skip on reflink/btrfs/zfs), "always", False
+    "size_prefilter": False,  # hash only files whose size another scanned file or DB row shares; older placeholders are re-hashed on collision (needs export_folder_meta off)
+    "partial_prefilter": False,  # with size_prefilter: also skip files whose first/last 64 KiB are unique
+    "hash_processes": False,  # hash in worker processes (CPU-bound SHA-256, large files)
+    "hash_cache": True,  # reuse digests of files whose size/mtime/inode are unchanged
     "ignore_patterns": [".git", "node_modules", "__pycache__", ".deduplab_duplicates"],
     "nsfw": {"enabled": False, "threshold": 2, "auto_quarantine": False},
     "logging": {"rotate_mb": 10, "keep": 7, "level": "INFO"},
@@ -54,7 +64,7 @@ def load_config(path="deduplab.yml"):
     
     if p.exists():
         try:
-            data = yaml.safe_load(p.read_text(encoding="utf-8"))
+            data = yaml.load(p.read_text(encoding="utf-8"), Loader=_Loader)
             if isinstance(data, dict):
                 cfg.update(data)
         except Exception as e:
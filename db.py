@@ -2,11 +2,14 @@
 # Copyright (c) 2025 Allaun
 
 from __future__ import annotations
+import os
 import sqlite3
 import sys
 import time
+from itertools import islice
 from pathlib import Path
-from typing import Iterable, Tuple, List
+from typing import Dict, Iterable, Iterator, Optional, Tuple, List
+from .hashing import UNHASHED_PREFIX
 
 # Migration system
 MIGRATIONS = {
@@ -30,9 +33,59 @@ MIGRATIONS = {
             applied_at INTEGER NOT NULL,
             description TEXT
         );
+    """,
+    5: """
+        -- Covering index so duplicate grouping is an index-order scan
+        -- (supersedes idx_files_hash_ctx, which is a prefix of it)
+        CREATE INDEX IF NOT EXISTS idx_files_hash_ctx_path 
+        ON files (sha256, context_tag, path);
+        DROP INDEX IF EXISTS idx_files_hash_ctx;
+    """,
+    6: """
+        -- Digests from earlier scans, reused while (size, mtime_ns, inode) match
+        CREATE TABLE IF NOT EXISTS hash_cache (
+            path TEXT NOT NULL,
+            algo TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            PRIMARY KEY (algo, path)
+        ) WITHOUT ROWID;
     """
 }
 
+# Per-connection tuning (not persisted in the database file)
+CONNECTION_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA wal_autocheckpoint=10000;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-262144;
+PRAGMA mmap_size=1073741824;
+"""
+
+# Page size for newly created databases (SQLite default is 4096)
+NEW_DB_PAGE_SIZE = 65536
+
+# Rows per executemany() call and transaction when upserting scan results
+UPSERT_BATCH = 50_000
+
+# Paths per hash cache lookup query (well under SQLite's bound-variable limit)
+HASH_CACHE_LOOKUP_BATCH = 500
+
+# New hash cache digests held in memory before being written out
+HASH_CACHE_FLUSH = 10_000
+
+UPSERT_ROWS_SQL = """INSERT INTO files(path, size, mtime, sha256, mime, context_tag) 
+    VALUES(?, ?, ?, ?, ?, ?)
+    ON CONFLICT(path) DO UPDATE SET 
+        size=excluded.size, 
+        mtime=excluded.mtime, 
+        sha256=excluded.sha256,
+        mime=excluded.mime,
+        context_tag=excluded.context_tag"""
+
 # Base schema (v0 - original)
 BASE_SCHEMA = """
 PRAGMA journal_mode=WAL;
@@ -52,6 +105,84 @@ CREATE TABLE IF NOT EXISTS runs(
 """
 
 
+class HashCache:
+    """
+    Content digests from earlier scans, for skipping unchanged files.
+    
+    An entry is only trusted while the file's size, mtime_ns and inode
+    all still match. Entries are queried per batch of paths rather than
+    loaded up front, and new digests are written every HASH_CACHE_FLUSH
+    files, so memory stays flat however large the cache is. Every path
+    looked up or stored is noted in a temp table, so DB.save_hash_cache
+    can drop entries for files that are gone.
+    """
+    
+    def __init__(self, conn: sqlite3.Connection, algo: str):
+        self.conn = conn
+        self.algo = algo
+        self.pending: List[Tuple[str, str, int, int, int, str]] = []
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS hash_seen(path TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+    
+    def _mark_seen(self, paths: Iterable[str]):
+        # Committed right away: an open transaction would pin a read
+        # snapshot that a later write can't upgrade from once another
+        # connection has written
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO temp.hash_seen VALUES(?)", ((p,) for p in paths)
+            )
+    
+    def lookup_many(self, files: Iterable[Tuple[str, object]]) -> Iterator[Optional[str]]:
+        """
+        Cached digest for each (path, stat) pair, in order; None where the
+        file changed or was never hashed. Queries HASH_CACHE_LOOKUP_BATCH
+        paths at a time.
+        """
+        it = iter(files)
+        while True:
+            batch = list(islice(it, HASH_CACHE_LOOKUP_BATCH))
+            if not batch:
+                return
+            paths = [p for p, _ in batch]
+            self._mark_seen(paths)
+            rows = self.conn.execute(
+                "SELECT path, size, mtime_ns, inode, digest FROM hash_cache "
+                f"WHERE algo = ? AND path IN ({','.join('?' * len(paths))})",
+                [self.algo, *paths]
+            )
+            entries = {r[0]: r[1:] for r in rows}
+            for path, st in batch:
+                entry = entries.get(path)
+                if (entry is not None and entry[0] == st.st_size
+                        and entry[1] == st.st_mtime_ns and entry[2] == st.st_ino):
+                    yield entry[3]
+                else:
+                    yield None
+    
+    def store(self, path: str, st, digest: str):
+        """Queue a freshly computed digest, writing the queue once it is full."""
+        self.pending.append(
+            (path, self.algo, st.st_size, st.st_mtime_ns, st.st_ino, digest)
+        )
+        if len(self.pending) >= HASH_CACHE_FLUSH:
+            self.flush()
+    
+    def flush(self):
+        """Write and commit queued digests."""
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hash_cache(path, algo, size, mtime_ns, inode, digest) "
+                "VALUES(?, ?, ?, ?, ?, ?)",
+                self.pending
+            )
+            self._mark_seen(r[0] for r in self.pending)
+        self.pending.clear()
+
+
 class DB:
     """
     SQLite database with automatic schema migrations.
@@ -62,6 +193,8 @@ class DB:
     - v2: Add context_tag column
     - v3: Add composite index
     - v4: Add schema_version table
+    - v5: Covering index for duplicate grouping
+    - v6: hash_cache table
     """
     
     def __init__(self, path: Path):
@@ -75,6 +208,12 @@ class DB:
         self.path.parent.mkdir(parents=True, exist_ok=True)
         self.conn = sqlite3.connect(self.path.as_posix(), timeout=30)
         
+        # page_size only takes effect before the first page is written, and
+        # a WAL database cannot change it later
+        if self.conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+            self.conn.execute(f"PRAGMA page_size={NEW_DB_PAGE_SIZE}")
+        self.conn.executescript(CONNECTION_PRAGMAS)
+        
         # Create base schema if new database
         self._init_base_schema()
         
@@ -146,48 +285,160 @@ class DB:
                     raise RuntimeError(f"Database migration failed at version {version}: {e}")
 
     def close(self):
-        """Close database connection."""
+        """Close database connection (refreshing planner statistics first)."""
+        try:
+            self.conn.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            pass
         self.conn.close()
 
     def upsert_files(self, records: Iterable[Tuple[str, int, int, str, str, str]]):
         """
         Insert or update file records.
         
+        Each UPSERT_BATCH rows are committed in their own transaction, and
+        the next batch is collected before the write lock is taken, so a
+        streamed scan does not lock other writers out while it hashes.
+        
         Args:
             records: Iterable of (path, size, mtime, sha256, mime, context_tag) tuples
         """
+        it = iter(records)
         cur = self.conn.cursor()
-        cur.executemany(
-            """INSERT INTO files(path, size, mtime, sha256, mime, context_tag) 
-               VALUES(?, ?, ?, ?, ?, ?) 
-               ON CONFLICT(path) DO UPDATE SET 
-                   size=excluded.size, 
-                   mtime=excluded.mtime, 
-                   sha256=excluded.sha256,
-                   mime=excluded.mime,
-                   context_tag=excluded.context_tag""",
-            records
-        )
-        self.conn.commit()
+        while True:
+            batch = list(islice(it, UPSERT_BATCH))
+            if not batch:
+                break
+            with self.conn:
+                # Take the write lock up front instead of upgrading mid-batch
+                if not self.conn.in_transaction:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                cur.executemany(UPSERT_ROWS_SQL, batch)
 
+    def size_collisions(self, files: Iterable[Tuple[str, int]]
+                        ) -> Tuple[Dict[int, int], List[str]]:
+        """
+        Look up existing rows that share a size with files about to be
+        (re)scanned, for the scanner's size prefilter.
+        
+        Rows for the given paths are ignored, since the scan rewrites them.
+        Works inside or outside an open transaction.
+        
+        Args:
+            files: Iterable of (path, size) for the files being scanned
+        
+        Returns:
+            Tuple of ({size: number of other rows with that size}, paths of
+            those rows that still hold an UNHASHED_PREFIX placeholder)
+        """
+        own_tx = not self.conn.in_transaction
+        cur = self.conn.cursor()
+        cur.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS scan_paths("
+            "path TEXT PRIMARY KEY, size INTEGER) WITHOUT ROWID"
+        )
+        try:
+            cur.execute("DELETE FROM temp.scan_paths")
+            cur.executemany("INSERT OR REPLACE INTO temp.scan_paths VALUES(?, ?)", files)
+            others = """
+                FROM files
+                WHERE size IN (SELECT size FROM temp.scan_paths)
+                  AND path NOT IN (SELECT path FROM temp.scan_paths)"""
+            counts = dict(cur.execute("SELECT size, COUNT(*)" + others + " GROUP BY size"))
+            stale = [r[0] for r in cur.execute(
+                "SELECT path" + others + " AND sha256 GLOB ?", (UNHASHED_PREFIX + "*",)
+            )]
+            cur.execute("DELETE FROM temp.scan_paths")
+        finally:
+            if own_tx and self.conn.in_transaction:
+                self.conn.commit()
+        return counts, stale
+    
+    def load_hash_cache(self, algo: str) -> HashCache:
+        """
+        Open the cache of digests computed with the given algorithm.
+        
+        Args:
+            algo: Content hash name ("sha256" or "blake3")
+        """
+        return HashCache(self.conn, algo)
+    
+    def save_hash_cache(self, cache: HashCache, roots: Iterable[str] = ()):
+        """
+        Write the cache's pending digests and commit.
+        
+        Entries under the scanned roots that the scan neither looked up nor
+        stored belong to deleted, moved or now-ignored files and are removed.
+        
+        Args:
+            cache: Cache the scan used
+            roots: Root directories that were scanned
+        """
+        with self.conn:
+            cache.flush()
+            for root in roots:
+                # Same form as the scanner's paths; a root of "." yields
+                # bare relative paths, which have no common prefix
+                base = str(Path(root))
+                if base == ".":
+                    continue
+                prefix = os.path.join(base, "")
+                # Every path starting with prefix sorts in [prefix, upper)
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                self.conn.execute(
+                    "DELETE FROM hash_cache WHERE algo = ? AND path >= ? AND path < ? "
+                    "AND path NOT IN (SELECT path FROM temp.hash_seen)",
+                    (cache.algo, prefix, upper)
+                )
+            self.conn.execute("DELETE FROM temp.hash_seen")
+    
     def get_duplicates(self) -> List[Tuple[str, str, str]]:
         """
         Get duplicate file groups (context-aware).
         
         Returns same hash + same context_tag as duplicates.
         Same hash + different context_tag are NOT duplicates.
+        Rows left unhashed by the scanner's size prefilter are skipped.
         
         Returns:
             List of (sha256, context_tag, pipe-separated paths) tuples
         """
         query = """
             SELECT sha256, context_tag, GROUP_CONCAT(path, '|') 
-            FROM files 
+            FROM files INDEXED BY idx_files_hash_ctx_path
+            WHERE sha256 NOT GLOB ?
             GROUP BY sha256, context_tag 
             HAVING COUNT(*) > 1
         """
-        return list(self.conn.execute(query))
+        return list(self.conn.execute(query, (UNHASHED_PREFIX + "*",)))
 
+    def get_duplicate_rows(self) -> Iterator[Tuple[str, str, str]]:
+        """
+        Stream files that belong to a duplicate group (context-aware).
+        
+        Same grouping as get_duplicates, but one row per file ordered by
+        (sha256, context_tag, path), so callers can itertools.groupby the
+        cursor without concatenating and re-splitting path strings (which
+        broke on paths containing the separator).
+        
+        Returns:
+            Cursor over (sha256, context_tag, path) tuples
+        """
+        # One in-order walk of the covering index plus a probe per row;
+        # no temp B-tree for the ORDER BY, so rows stream immediately
+        query = """
+            SELECT sha256, context_tag, path
+            FROM files AS f INDEXED BY idx_files_hash_ctx_path
+            WHERE sha256 NOT GLOB ? AND EXISTS (
+                SELECT 1 FROM files AS g INDEXED BY idx_files_hash_ctx_path
+                WHERE g.sha256 = f.sha256
+                  AND g.context_tag = f.context_tag
+                  AND g.path <> f.path
+            )
+            ORDER BY sha256, context_tag, path
+        """
+        return self.conn.execute(query, (UNHASHED_PREFIX + "*",))
+    
     def get_all(self):
         """Get all file records."""
         return list(self.conn.execute(
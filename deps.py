@@ -42,6 +42,21 @@ OPTIONAL_DEPS = {
         "package": "psutil",
         "feature": "System resource detection",
         "fallback": "Conservative defaults for CPU/memory"
+    },
+    "orjson": {
+        "package": "orjson",
+        "feature": "Fast JSON serialization",
+        "fallback": "Standard library json"
+    },
+    "blake3": {
+        "package": "blake3",
+        "feature": "BLAKE3 content hashing (hash_algo: blake3)",
+        "fallback": "SHA-256"
+    },
+    "xxhash": {
+        "package": "xxhash",
+        "feature": "Fast post-copy verification hash (xxh3_128)",
+        "fallback": "SHA-256"
     }
 }
 
@@ -1,11 +1,11 @@
 # SPDX-License-Identifier: Apache-2.0
 # Copyright (c) 2025 Allaun
 
-import json
 from pathlib import Path
 from collections import Counter
 from .categorizer import categorize_file
 from .validator import validate_meta_dict
+from .jsonutil import dumps
 
 
 def _iso_now():
@@ -24,12 +24,13 @@ def write_folder_meta(folder_path: Path, file_records: list, root_path: Path, pr
         pretty: If True, pretty-print JSON
         silent: If True, suppress error messages
     """
-    cats = Counter([categorize_file(r["mime"], r["name"])["category"] for r in file_records])
+    # Categorize each file once; reused for the summary and the entries
+    file_cats = [categorize_file(r["mime"], r["name"]) for r in file_records]
+    cats = Counter(c["category"] for c in file_cats)
     topics = []
     keywords = set()
     
-    for r in file_records:
-        c = categorize_file(r["mime"], r["name"])
+    for r, c in zip(file_records, file_cats):
         if c.get("topic"): 
             topics.append(c["topic"])
         
@@ -56,8 +57,7 @@ def write_folder_meta(folder_path: Path, file_records: list, root_path: Path, pr
         "entries": []
     }
     
-    for r in file_records:
-        c = categorize_file(r["mime"], r["name"])
+    for r, c in zip(file_records, file_cats):
         entry = {
             "name": r["name"],
             "size": int(r["size"]),
@@ -80,18 +80,13 @@ def write_folder_meta(folder_path: Path, file_records: list, root_path: Path, pr
     
     if ok:
         tmp = meta_path.with_suffix(".json.tmp")
-        with open(tmp, "w", encoding="utf-8", newline="\n") as f:
-            if pretty:
-                json.dump(meta, f, ensure_ascii=False, sort_keys=True, indent=2)
-            else:
-                json.dump(meta, f, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
-            f.write("\n")
+        with open(tmp, "wb") as f:
+            f.write(dumps(meta, pretty=pretty, sort_keys=True) + b"\n")
         tmp.replace(meta_path)
     else:
         bad = meta_path.with_suffix(".invalid.json")
-        with open(bad, "w", encoding="utf-8", newline="\n") as f:
-            json.dump(meta, f, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
-            f.write("\n")
+        with open(bad, "wb") as f:
+            f.write(dumps(meta, sort_keys=True) + b"\n")
         
         if not silent:
             print(f"[meta][INVALID] {folder_path}: {err}")
\ No newline at end of file
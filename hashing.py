@@ -0,0 +1,354 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Allaun
+
+"""
+File hashing shared by the scanner and the applier.
+Selects the fastest SHA-256 backend once and streams files through it
+with read-ahead and page-cache hints (mmap only for files we own).
+"""
+
+from __future__ import annotations
+import io
+import os
+import sys
+import hashlib
+import functools
+import mmap
+import threading
+from typing import Tuple
+from .deps import check_dep
+
+CHUNK = 1024 * 1024  # 1MB chunks for I/O
+
+# Digest placeholder prefix for files skipped by the scanner's size
+# prefilter ("size:<bytes>", or "size:<bytes>:<partial sha256>" after the
+# head/tail pass); such rows can never be duplicates and are ignored when
+# grouping
+UNHASHED_PREFIX = "size:"
+
+# Bytes read from each end of a file for its partial signature
+PARTIAL_SPAN = 64 * 1024
+
+
+def _has_sha_extensions() -> bool:
+    """
+    Check whether the CPU advertises SHA-256 instructions.
+    
+    Looks for `sha_ni` (x86) or `sha2` (ARMv8) in /proc/cpuinfo.
+    Non-Linux platforms report False; this only affects the backend label.
+    """
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    flags = line.split(":", 1)[1].split()
+                    return "sha_ni" in flags or "sha2" in flags
+    except OSError:
+        pass
+    return False
+
+
+def _select_sha256():
+    """
+    Select the fastest available SHA-256 constructor.
+    
+    OpenSSL's EVP implementation dispatches to SHA-NI / ARMv8 SHA2
+    instructions at runtime. CPython's builtin fallback (used when the
+    interpreter is built without OpenSSL) is portable C without them.
+    
+    Returns:
+        Tuple of (constructor, backend name); the constructor takes an
+        optional initial buffer like hashlib.sha256
+    """
+    ctor = hashlib.sha256
+    if ctor.__name__ == "openssl_sha256":
+        backend = "openssl+sha_ni" if _has_sha_extensions() else "openssl"
+    else:
+        backend = "builtin"
+    
+    # Content fingerprints, not security: keeps FIPS-mode OpenSSL builds
+    # on their fast path instead of refusing or routing through a provider
+    return functools.partial(ctor, usedforsecurity=False), backend
+
+
+# Resolved once per process
+new_sha256, SHA256_BACKEND = _select_sha256()
+
+# Number of CHUNKs kept queued with the kernel ahead of the hash cursor
+READAHEAD_CHUNKS = 8
+
+# Linux-only; 0 elsewhere
+_O_NOATIME = getattr(os, "O_NOATIME", 0)
+
+# Windows-only; without it os.open() fds are in CRT text mode (CRLF
+# translation, ^Z read as end of file)
+_O_BINARY = getattr(os, "O_BINARY", 0)
+
+# mmap is only used on files this process wrote (see hash_file): a file
+# truncated by another process while mapped raises SIGBUS, not OSError.
+# Below this, mapping costs more than a single read() and copy
+MMAP_MIN_BYTES = CHUNK
+
+# Files up to this size are hashed from one mmap in a single C call
+MMAP_MAX_BYTES = 256 * 1024 * 1024
+
+# Larger files are mapped in windows of this size (multiple of the mmap
+# allocation granularity) to bound address-space use
+MMAP_WINDOW = 16 * 1024 * 1024
+
+# mmap.madvise needs Python 3.8+ and a POSIX platform
+_MADV_SEQUENTIAL = getattr(mmap, "MADV_SEQUENTIAL", None)
+
+
+def fadvise(fd: int, advice: str, offset: int = 0, length: int = 0):
+    """
+    posix_fadvise wrapper taking the advice name ("SEQUENTIAL", ...).
+    
+    Advisory only: no-op where posix_fadvise is unavailable (Windows,
+    macOS) and errors are ignored. offset/length 0 covers the whole file.
+    """
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, "POSIX_FADV_" + advice))
+        except OSError:
+            pass
+
+
+def _readahead(fd: int, offset: int, length: int):
+    """
+    Ask the kernel to start reading a byte range in the background.
+    
+    Keeps several reads in flight per file so the device sees a queue
+    depth > 1 while the hash consumes earlier chunks.
+    """
+    fadvise(fd, "WILLNEED", offset, length)
+
+
+def open_ro(path: str) -> int:
+    """
+    Open a file read-only, without updating its access time if allowed.
+    
+    O_NOATIME saves an inode write per read on filesystems mounted without
+    noatime; the kernel refuses it (EPERM) for files we do not own.
+    """
+    if _O_NOATIME:
+        try:
+            return os.open(path, os.O_RDONLY | _O_BINARY | _O_NOATIME)
+        except PermissionError:
+            pass
+    return os.open(path, os.O_RDONLY | _O_BINARY)
+
+
+def sha256_file(p) -> str:
+    """
+    Compute SHA-256 hash of file.
+    
+    Args:
+        p: Path to file (Path or str)
+    
+    Returns:
+        Lowercase hex digest (64 characters)
+    """
+    return hash_file(p, new_sha256)
+
+
+def blake3_file(p) -> str:
+    """
+    Compute BLAKE3 hash of file (requires the optional blake3 package).
+    
+    Module-level so it can be sent to worker processes.
+    
+    Returns:
+        "blake3:"-prefixed lowercase hex digest
+    """
+    import blake3
+    ctor = functools.partial(blake3.blake3, max_threads=blake3.blake3.AUTO)
+    return "blake3:" + hash_file(p, ctor)
+
+
+def _read_at(fd: int, n: int, offset: int) -> bytes:
+    """
+    Read up to n bytes at offset, stopping early only at end of file.
+    
+    Uses os.pread where it exists; elsewhere (Windows) seeks and reads.
+    """
+    parts = []
+    while n > 0:
+        if hasattr(os, "pread"):
+            part = os.pread(fd, n, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            part = os.read(fd, n)
+        if not part:
+            break
+        parts.append(part)
+        n -= len(part)
+        offset += len(part)
+    return b"".join(parts)
+
+
+def partial_sha256(p) -> Tuple[str, bool]:
+    """
+    SHA-256 over the first and last PARTIAL_SPAN bytes of a file.
+    
+    Files that differ here cannot be identical, so equal-size files with
+    distinct partial signatures need no full hash. Files up to
+    2 * PARTIAL_SPAN are covered completely, and their signature is
+    their full SHA-256.
+    
+    Returns:
+        Tuple of (lowercase hex digest, True if it covers the whole file)
+    """
+    fd = open_ro(os.fspath(p))
+    try:
+        size = os.fstat(fd).st_size
+        h = new_sha256(_read_at(fd, PARTIAL_SPAN, 0))
+        if size > PARTIAL_SPAN:
+            tail = max(PARTIAL_SPAN, size - PARTIAL_SPAN)
+            h.update(_read_at(fd, size - tail, tail))
+    finally:
+        os.close(fd)
+    return h.hexdigest(), size <= 2 * PARTIAL_SPAN
+
+
+def select_content_hash(algo: str = "sha256"):
+    """
+    Resolve cfg["hash_algo"] to the scanner's file-hashing function.
+    
+    "sha256" digests are stored as bare hex (the historical format).
+    "blake3" (optional blake3 package; multi-threaded within large files)
+    digests carry a "blake3:" prefix, so they never compare equal to a
+    SHA-256 row. Unknown or unavailable algorithms fall back to SHA-256.
+    
+    Args:
+        algo: Algorithm name from configuration
+    
+    Returns:
+        Tuple of (function(path) -> digest string, backend name)
+    """
+    algo = (algo or "sha256").lower()
+    
+    if algo == "blake3":
+        if check_dep("blake3"):
+            return blake3_file, "blake3"
+        print("[hashing][WARN] blake3 unavailable, using sha256", file=sys.stderr)
+    elif algo != "sha256":
+        print(f"[hashing][WARN] Unknown hash_algo {algo!r}, using sha256", file=sys.stderr)
+    
+    return sha256_file, SHA256_BACKEND
+
+
+def _madvise_sequential(mm: mmap.mmap):
+    """Hint sequential access for a mapping; no-op where unsupported."""
+    if _MADV_SEQUENTIAL is not None:
+        try:
+            mm.madvise(_MADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def _hash_mmap(fd: int, size: int, ctor) -> str:
+    """
+    Hash an open file through mmap, zero-copy into the hash.
+    
+    Files up to MMAP_MAX_BYTES use one mapping; larger ones are walked in
+    MMAP_WINDOW slices with the next slice queued for read-ahead.
+    Mappings are marked sequential so page faults read ahead aggressively.
+    """
+    h = ctor()
+    if size <= MMAP_MAX_BYTES:
+        _readahead(fd, 0, size)
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            _madvise_sequential(mm)
+            h.update(mm)
+        return h.hexdigest()
+    
+    _readahead(fd, 0, MMAP_WINDOW)
+    for offset in range(0, size, MMAP_WINDOW):
+        _readahead(fd, offset + MMAP_WINDOW, MMAP_WINDOW)
+        length = min(MMAP_WINDOW, size - offset)
+        with mmap.mmap(fd, length, access=mmap.ACCESS_READ, offset=offset) as mm:
+            _madvise_sequential(mm)
+            h.update(mm)
+    return h.hexdigest()
+
+
+# Per-thread read buffer for the streaming path (hash workers run in threads)
+_tls = threading.local()
+
+
+def _read_buffer() -> memoryview:
+    """This thread's reusable CHUNK-sized buffer."""
+    buf = getattr(_tls, "buf", None)
+    if buf is None:
+        buf = _tls.buf = memoryview(bytearray(CHUNK))
+    return buf
+
+
+def hash_file(p, ctor, drop_cache: bool = False, use_mmap: bool = False) -> str:
+    """
+    Hash a whole file with the given hashlib-style constructor.
+    
+    Args:
+        p: Path to file (Path or str)
+        ctor: Hash constructor taking no arguments (e.g. new_sha256)
+        drop_cache: Release the file's pages afterwards; only for files
+            this process wrote and won't read again (the applier's verify
+            pass). Scanned files may be in active use by others.
+        use_mmap: Hash large files through mmap; only for files no other
+            process can truncate mid-hash (a shrinking mapping kills the
+            process with SIGBUS). Scanned files always stream.
+    
+    Returns:
+        Lowercase hex digest
+    """
+    window = CHUNK * READAHEAD_CHUNKS
+    fd = open_ro(os.fspath(p))
+    try:
+        size = os.fstat(fd).st_size
+        
+        # Small file: read to EOF without hint syscalls (usually one read;
+        # short reads loop, and one extra byte detects growth)
+        if size < CHUNK:
+            parts = []
+            got = 0
+            while got <= size:
+                part = os.read(fd, size + 1 - got)
+                if not part:
+                    break
+                parts.append(part)
+                got += len(part)
+            data = b"".join(parts)
+            if got <= size:
+                return ctor(data).hexdigest()
+            h, offset = ctor(data), got
+        else:
+            h, offset = ctor(), 0
+        
+        # One sequential pass
+        fadvise(fd, "SEQUENTIAL")
+        
+        # Fast path: no per-chunk Python loop or bytes allocations
+        if use_mmap and size >= MMAP_MIN_BYTES:
+            try:
+                return _hash_mmap(fd, size, ctor)
+            except (OSError, ValueError):
+                pass  # Filesystem without mmap support; stream instead
+        
+        # Read into one reused buffer instead of a new bytes per chunk
+        buf = _read_buffer()
+        raw = io.FileIO(fd, "rb", closefd=False)  # unbuffered readinto()
+        _readahead(fd, offset, window)
+        while True:
+            n = raw.readinto(buf)
+            if not n:
+                break
+            offset += n
+            # Slide the read-ahead window forward by one chunk
+            _readahead(fd, offset + window - CHUNK, CHUNK)
+            h.update(buf[:n])
+    finally:
+        if drop_cache:
+            fadvise(fd, "DONTNEED")
+        os.close(fd)
+    return h.hexdigest()
\ No newline at end of file
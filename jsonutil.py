@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Allaun
+
+"""
+JSON encoding/decoding with orjson when available.
+Falls back to the stdlib json module with identical call signatures.
+"""
+
+import json
+from .deps import check_dep
+
+
+_orjson = None  # orjson module, False if unavailable, None until checked
+
+
+def _backend():
+    """Resolve orjson once, on first use (not at import time)."""
+    global _orjson
+    if _orjson is None:
+        if check_dep("orjson"):
+            import orjson
+            _orjson = orjson
+        else:
+            _orjson = False
+    return _orjson
+
+
+def dumps(obj, pretty: bool = False, sort_keys: bool = False) -> bytes:
+    """
+    Serialize obj to UTF-8 JSON bytes.
+    
+    Args:
+        obj: JSON-compatible object
+        pretty: If True, indent with 2 spaces; otherwise compact separators
+        sort_keys: If True, sort object keys
+    
+    Returns:
+        Encoded JSON (no trailing newline)
+    """
+    orjson = _backend()
+    if orjson:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+    
+    if pretty:
+        text = json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, indent=2)
+    else:
+        text = json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, separators=(",", ":"))
+    return text.encode("utf-8")
+
+
+def loads(data):
+    """
+    Parse JSON from bytes or str.
+    
+    Raises:
+        ValueError: If data is not valid JSON
+    """
+    orjson = _backend()
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
\ No newline at end of file
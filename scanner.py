@@ -3,16 +3,21 @@
 
 from __future__ import annotations
 import os
+import re
 import time
-import hashlib
+import fnmatch
+import functools
 import mimetypes
+import multiprocessing
 import sys
+import queue
+import threading
+from collections import Counter
 from pathlib import Path
-from typing import Iterable, List, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from .deps import check_dep
-
-CHUNK = 1024 * 1024  # 1MB chunks for I/O
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from .deps import check_dep, init_deps
+from .hashing import UNHASHED_PREFIX, partial_sha256, sha256_file
 
 # Archive and extraction detection
 ARCHIVE_EXTENSIONS = {'.zip', '.7z', '.tar', '.gz', '.bz2', '.xz', '.rar', 
@@ -21,25 +26,152 @@ ARCHIVE_EXTENSIONS = {'.zip', '.7z', '.tar', '.gz', '.bz2', '.xz', '.rar',
 EXTRACTION_MARKERS = {'extracted', 'unzipped', 'unpacked', 'unarchived', 
                       'decompressed', 'unrar', 'untar'}
 
+# ARCHIVE_EXTENSIONS split by dot count, so a name needs at most two lookups
+_SINGLE_EXTS = frozenset(ext for ext in ARCHIVE_EXTENSIONS if ext.count('.') == 1)
+_DOUBLE_EXTS = frozenset(ARCHIVE_EXTENSIONS) - _SINGLE_EXTS
 
-def _should_skip(p: Path, ignore: List[str]) -> bool:
-    """Check if path should be skipped based on ignore patterns."""
-    parts = set(p.parts)
-    return any(ig in parts for ig in ignore)
+# Folder-name fragments that mark an extraction: the markers plus archive
+# extensions as they appear in folder names ('.tar.gz' -> '_tar_gz', 'targz').
+# Fragments containing a shorter one can never decide alone, and the rest
+# are searched with one regex
+_NAME_HINTS = set(EXTRACTION_MARKERS) | \
+              {ext.replace('.', '_') for ext in ARCHIVE_EXTENSIONS} | \
+              {ext.replace('.', '') for ext in ARCHIVE_EXTENSIONS}
+_NAME_HINT_RE = re.compile("|".join(sorted(
+    re.escape(t) for t in _NAME_HINTS
+    if not any(o != t and o in t for o in _NAME_HINTS)
+)))
+
+
+# Files smaller than this are handed to hash workers in batches of up to
+# HASH_BATCH_FILES, so queue hand-offs don't outweigh the hashing itself
+SMALL_FILE_BYTES = 64 * 1024
+HASH_BATCH_FILES = 64
+
+# Seconds between text progress lines when tqdm is unavailable
+PROGRESS_INTERVAL = 1.0
+
+
+class IgnoreMatcher:
+    """
+    Compiled ignore patterns, matched against each path component.
+    
+    Every pattern matches its exact name, checked with one set
+    intersection; patterns with a * or ? wildcard ("*.tmp", "cache-?",
+    "[0-9]*") are also folded into a single regex via fnmatch.translate.
+    Brackets alone don't make a glob, so literal names such as "[old]"
+    (ignored before globs existed) keep matching only themselves.
+    """
+    
+    __slots__ = ("literals", "regex")
+    
+    def __init__(self, patterns: Iterable[str]):
+        literals = set()
+        globs = []
+        for pat in patterns:
+            literals.add(pat)
+            if "*" in pat or "?" in pat:
+                globs.append(fnmatch.translate(pat))
+        self.literals = frozenset(literals)
+        self.regex: Optional[re.Pattern] = (
+            re.compile("|".join(f"(?:{g})" for g in globs)) if globs else None
+        )
+    
+    def __call__(self, p: Path) -> bool:
+        parts = p.parts
+        if not self.literals.isdisjoint(parts):
+            return True
+        if self.regex is not None:
+            match = self.regex.match
+            return any(match(part) for part in parts)
+        return False
+    
+    def match_name(self, name: str) -> bool:
+        """Match a single path component (e.g. a directory entry name)."""
+        if name in self.literals:
+            return True
+        return self.regex is not None and self.regex.match(name) is not None
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_ignore(patterns: Tuple[str, ...]) -> IgnoreMatcher:
+    return IgnoreMatcher(patterns)
 
 
-def _sha256_file(p: Path) -> str:
-    """Compute SHA-256 hash of file."""
-    h = hashlib.sha256()
-    with p.open("rb") as f:
-        for chunk in iter(lambda: f.read(CHUNK), b""):
-            h.update(chunk)
-    return h.hexdigest()
+def compile_ignore(ignore: Union[Iterable[str], IgnoreMatcher]) -> IgnoreMatcher:
+    """
+    Build (or reuse) the matcher for a list of ignore patterns.
+    
+    Matchers are cached by pattern tuple, so repeated scans with the same
+    configuration compile once. An IgnoreMatcher is returned unchanged.
+    """
+    if isinstance(ignore, IgnoreMatcher):
+        return ignore
+    return _compile_ignore(tuple(ignore))
+
+
+def _should_skip(p: Path, ignore: Union[List[str], IgnoreMatcher]) -> bool:
+    """Check if path should be skipped based on ignore patterns."""
+    return compile_ignore(ignore)(p)
 
 
 def _is_archive(path: Path) -> bool:
     """Check if file is an archive by extension."""
-    return any(str(path).lower().endswith(ext) for ext in ARCHIVE_EXTENSIONS)
+    name = path.name.lower()
+    dot = name.rfind('.')
+    if dot == -1:
+        return False
+    if name[dot:] in _SINGLE_EXTS:
+        return True
+    return dot > 0 and name[name.rfind('.', 0, dot):] in _DOUBLE_EXTS
+
+
+@functools.lru_cache(maxsize=1024)
+def _dir_entries(directory: Path) -> frozenset:
+    """Names in a directory, listed once; empty if it can't be read."""
+    try:
+        return frozenset(os.listdir(directory))
+    except OSError:
+        return frozenset()
+
+
+@functools.lru_cache(maxsize=None)
+def _parent_is_extraction(parent: Path) -> bool:
+    """Apply the _is_inside_archive checks to a single directory."""
+    name = parent.name
+    parent_name = name.lower()
+    if not parent_name:
+        return False  # Filesystem root or '.'
+    
+    # Check extraction markers and archive-like folder names (no I/O, so
+    # before the adjacent-archive check)
+    if _NAME_HINT_RE.search(parent_name):
+        return True
+    
+    # Check for adjacent archive (one listing of the grandparent serves
+    # every sibling instead of a stat per extension)
+    siblings = _dir_entries(parent.parent)
+    for ext in ARCHIVE_EXTENSIONS:
+        if name + ext in siblings and parent.with_name(name + ext).is_file():
+            return True
+    
+    return False
+
+
+@functools.lru_cache(maxsize=None)
+def _dir_inside_archive(directory: Path) -> bool:
+    """Whether a directory or any of its ancestors looks extracted."""
+    if _parent_is_extraction(directory):
+        return True
+    up = directory.parent
+    return up != directory and _dir_inside_archive(up)
+
+
+def _clear_context_cache():
+    """Forget cached directory decisions; the filesystem may have changed."""
+    _dir_entries.cache_clear()
+    _parent_is_extraction.cache_clear()
+    _dir_inside_archive.cache_clear()
 
 
 def _is_inside_archive(path: Path) -> bool:
@@ -50,27 +182,10 @@ def _is_inside_archive(path: Path) -> bool:
     1. Parent folder name matches archive without extension
     2. Path contains extraction marker keywords
     3. Adjacent archive file with same name exists
-    """
-    for parent in path.parents:
-        parent_str = str(parent).lower()
-        parent_name = parent.name.lower()
-        
-        # Check extraction markers
-        if any(marker in parent_name for marker in EXTRACTION_MARKERS):
-            return True
-        
-        # Check for adjacent archive
-        for ext in ARCHIVE_EXTENSIONS:
-            archive_candidate = parent.with_name(parent.name + ext)
-            if archive_candidate.exists() and archive_candidate.is_file():
-                return True
-        
-        # Check for archive-like folder names
-        for ext in ARCHIVE_EXTENSIONS:
-            if ext.replace('.', '_') in parent_name or ext.replace('.', '') in parent_name:
-                return True
     
-    return False
+    Decisions are cached per directory, so siblings cost one lookup.
+    """
+    return _dir_inside_archive(path.parent)
 
 
 def _detect_context(p: Path) -> str:
@@ -134,13 +249,53 @@ def _init_mime_types():
 _init_mime_types()
 
 
+# Additional manual mappings for extensions mimetypes doesn't know
+_EXTENSION_MAP = {
+    '.md': 'text/markdown',
+    '.yaml': 'text/yaml',
+    '.yml': 'text/yaml',
+    '.toml': 'text/toml',
+    '.ini': 'text/plain',
+    '.log': 'text/plain',
+    '.conf': 'text/plain',
+    '.cfg': 'text/plain',
+    '.sh': 'application/x-sh',
+    '.bash': 'application/x-sh',
+    '.zsh': 'application/x-sh',
+    '.py': 'text/x-python',
+    '.js': 'application/javascript',
+    '.ts': 'application/typescript',
+    '.jsx': 'text/jsx',
+    '.tsx': 'text/tsx',
+    '.rs': 'text/x-rust',
+    '.go': 'text/x-go',
+    '.c': 'text/x-c',
+    '.cpp': 'text/x-c++',
+    '.h': 'text/x-c',
+    '.hpp': 'text/x-c++',
+}
+
+# Suffix -> MIME, built once: mimetypes' table wins over the manual one,
+# exactly as the guess_type-then-fallback order did per call.
+_MIME_BY_SUFFIX = {**_EXTENSION_MAP,
+                   **{ext: mime for ext, mime in mimetypes.types_map.items()
+                      if ext == ext.lower()}}
+
+# Compression suffixes (.gz, .tgz, ...) make guess_type look at the inner
+# extension, so those names still take the slow path.
+_ENCODED_SUFFIXES = frozenset(
+    ext.lower() for ext in (*mimetypes.suffix_map, *mimetypes.encodings_map)
+)
+
+
 def _get_mime_safe(p: Path) -> str:
     """
     Get MIME type with comprehensive fallback.
     
     Strategy:
-    1. Try standard mimetypes.guess_type()
-    2. Check custom mappings
+    1. Look up the lower-cased suffix in a table prebuilt from mimetypes
+       plus custom mappings (no per-call parsing or allocation)
+    2. Compressed names (.tar.gz etc.): standard mimetypes.guess_type()
     3. Fallback to application/octet-stream
     
     Args:
@@ -149,164 +304,547 @@ def _get_mime_safe(p: Path) -> str:
     Returns:
         MIME type string (never None)
     """
-    # Primary method
-    mime, encoding = mimetypes.guess_type(str(p))
-    
-    if mime:
-        return mime
-    
-    # Fallback: check by extension directly
     suffix_lower = p.suffix.lower()
     
-    # Additional manual mappings for edge cases
-    extension_map = {
-        '.md': 'text/markdown',
-        '.yaml': 'text/yaml',
-        '.yml': 'text/yaml',
-        '.toml': 'text/toml',
-        '.ini': 'text/plain',
-        '.log': 'text/plain',
-        '.conf': 'text/plain',
-        '.cfg': 'text/plain',
-        '.sh': 'application/x-sh',
-        '.bash': 'application/x-sh',
-        '.zsh': 'application/x-sh',
-        '.py': 'text/x-python',
-        '.js': 'application/javascript',
-        '.ts': 'application/typescript',
-        '.jsx': 'text/jsx',
-        '.tsx': 'text/tsx',
-        '.rs': 'text/x-rust',
-        '.go': 'text/x-go',
-        '.c': 'text/x-c',
-        '.cpp': 'text/x-c++',
-        '.h': 'text/x-c',
-        '.hpp': 'text/x-c++',
-    }
-    
-    if suffix_lower in extension_map:
-        return extension_map[suffix_lower]
+    if suffix_lower in _ENCODED_SUFFIXES:
+        mime, encoding = mimetypes.guess_type(p.name)
+        if mime:
+            return mime
+        return _EXTENSION_MAP.get(suffix_lower, "application/octet-stream")
     
     # Ultimate fallback
-    return "application/octet-stream"
+    return _MIME_BY_SUFFIX.get(suffix_lower, "application/octet-stream")
 
 
-def iter_files(roots: Iterable[str], ignore: List[str]) -> Iterable[Path]:
-    """Generate all files to be scanned."""
+def _iter_entries(roots: Iterable[str],
+                  ignore: Union[List[str], IgnoreMatcher]) -> Iterator[os.DirEntry]:
+    """
+    Walk roots with os.scandir, yielding a DirEntry per regular file.
+    
+    Ignored names prune whole directories instead of being re-checked for
+    every file below them. Symlinked directories are not followed (as with
+    Path.rglob); symlinks to files are yielded. Unreadable directories are
+    skipped.
+    """
+    matcher = compile_ignore(ignore)
     for r in roots:
-        rp = Path(r)
-        if not rp.exists():
+        if not os.path.isdir(r) or matcher(Path(r)):
+            continue
+        stack = [os.fspath(r)]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for e in it:
+                    if matcher.match_name(e.name):
+                        continue
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            stack.append(e.path)
+                        elif e.is_file():
+                            yield e
+                    except OSError:
+                        continue
+
+
+def iter_files(roots: Iterable[str],
+               ignore: Union[List[str], IgnoreMatcher]) -> Iterable[Path]:
+    """Generate all files to be scanned."""
+    for e in _iter_entries(roots, ignore):
+        yield Path(e.path)
+
+
+def _stat_files(roots: Iterable[str], ignore: Union[List[str], IgnoreMatcher]
+                ) -> List[Tuple[Path, os.stat_result]]:
+    """
+    Collect (path, stat) for every file to be scanned.
+    
+    The stat is taken once, from the scandir entry, and reused for the
+    size prefilter and the result records. Files that vanish or can't be
+    stat'ed are dropped.
+    """
+    files = []
+    for e in _iter_entries(roots, ignore):
+        try:
+            files.append((Path(e.path), e.stat()))
+        except OSError:
+            continue
+    return files
+
+
+def _size_prefilter(files: List[Tuple[Path, os.stat_result]], known_sizes=None):
+    """
+    Split files into hash candidates and files with a unique size.
+    
+    A file whose size no other scanned file shares, nor any counted in
+    known_sizes ({size: count} of files outside this list: database rows
+    from earlier scans, cache hits), cannot have a duplicate, so it is
+    recorded with an UNHASHED_PREFIX placeholder instead of being read.
+    
+    Returns:
+        Tuple of ((path, stat) pairs to hash, result records for
+        unique-size files)
+    """
+    counts = Counter(st.st_size for _, st in files)
+    if known_sizes:
+        counts.update(known_sizes)
+    
+    to_hash: List[Tuple[Path, os.stat_result]] = []
+    unique: List[Tuple[str, int, int, str, str, str]] = []
+    for p, st in files:
+        if counts[st.st_size] > 1:
+            to_hash.append((p, st))
+            continue
+        try:
+            unique.append((
+                str(p),
+                st.st_size,
+                int(st.st_mtime),
+                f"{UNHASHED_PREFIX}{st.st_size}",
+                _get_mime_safe(p),
+                _detect_context(p)
+            ))
+        except Exception as e:
+            print(f"[scanner][WARN] Failed to process {p}: {e}", file=sys.stderr)
+    return to_hash, unique
+
+
+def _split_cached(files: List[Tuple[Path, os.stat_result]], hash_cache):
+    """
+    Split files into ones that still need hashing and records for files
+    whose digest the cache already holds.
+    
+    Returns:
+        Tuple of ((path, stat) pairs to hash, result records for cache hits)
+    """
+    to_hash: List[Tuple[Path, os.stat_result]] = []
+    cached: List[Tuple[str, int, int, str, str, str]] = []
+    digests = hash_cache.lookup_many((str(p), st) for p, st in files)
+    for (p, st), digest in zip(files, digests):
+        if digest is None:
+            to_hash.append((p, st))
+            continue
+        try:
+            cached.append((
+                str(p),
+                st.st_size,
+                int(st.st_mtime),
+                digest,
+                _get_mime_safe(p),
+                _detect_context(p)
+            ))
+        except Exception as e:
+            print(f"[scanner][WARN] Failed to process {p}: {e}", file=sys.stderr)
+    return to_hash, cached
+
+
+def _partial_prefilter(files: List[Tuple[Path, os.stat_result]], workers: int,
+                       exclude_sizes=frozenset(), sig_is_digest: bool = False,
+                       hash_cache=None):
+    """
+    Split same-size files by a head/tail signature before full hashing.
+    
+    Within each size group, a file whose partial_sha256 no other member
+    shares cannot have a duplicate, so it is recorded with an
+    UNHASHED_PREFIX placeholder carrying the signature. Sizes in
+    exclude_sizes (groups with members that are not in files, e.g. cache
+    hits or database rows from earlier scans) always go to full hashing. Files whose signature can't be read
+    are left for the full hash to report.
+    
+    With sig_is_digest (the content hash is plain SHA-256), a signature
+    that covers the whole file is that file's digest: it is recorded as
+    hashed (and stored in hash_cache) instead of being read again.
+    
+    Returns:
+        Tuple of ((path, stat) pairs to hash, result records for files
+        with a unique partial signature or a complete one)
+    """
+    to_hash: List[Tuple[Path, os.stat_result]] = []
+    candidates: List[Tuple[Path, os.stat_result]] = []
+    for p, st in files:
+        if st.st_size in exclude_sizes:
+            to_hash.append((p, st))
+        else:
+            candidates.append((p, st))
+    
+    signed = []
+    complete = []
+    for p, st, res, err in _hash_pipeline(candidates, partial_sha256, workers):
+        if err is not None:
+            to_hash.append((p, st))
+        elif sig_is_digest and res[1]:
+            complete.append((p, st, res[0]))
+        else:
+            signed.append((p, st, res[0]))
+    counts = Counter((st.st_size, sig) for _, st, sig in signed)
+    
+    unique: List[Tuple[str, int, int, str, str, str]] = []
+    for p, st, digest in complete:
+        try:
+            unique.append((
+                str(p),
+                st.st_size,
+                int(st.st_mtime),
+                digest,
+                _get_mime_safe(p),
+                _detect_context(p)
+            ))
+            if hash_cache is not None:
+                hash_cache.store(str(p), st, digest)
+        except Exception as e:
+            print(f"[scanner][WARN] Failed to process {p}: {e}", file=sys.stderr)
+    for p, st, sig in signed:
+        if counts[st.st_size, sig] > 1:
+            to_hash.append((p, st))
             continue
-        for p in rp.rglob("*"):
-            if p.is_file() and not _should_skip(p, ignore):
-                yield p
+        try:
+            unique.append((
+                str(p),
+                st.st_size,
+                int(st.st_mtime),
+                f"{UNHASHED_PREFIX}{st.st_size}:{sig}",
+                _get_mime_safe(p),
+                _detect_context(p)
+            ))
+        except Exception as e:
+            print(f"[scanner][WARN] Failed to process {p}: {e}", file=sys.stderr)
+    return to_hash, unique
 
 
-def threaded_hash(roots: Iterable[str], ignore: List[str], workers: int = 4):
+def _hash_pipeline(files: Iterable[Tuple[Path, os.stat_result]],
+                   hash_fn: Callable[[Path], str], workers: int
+                   ) -> Iterator[Tuple[Path, os.stat_result, Optional[str], Optional[Exception]]]:
     """
-    Scan files and compute hashes with progress indicators.
+    Hash files on worker threads fed through a bounded queue.
+    
+    A feeder thread keeps at most workers*4 tasks queued, and at most
+    workers*4 finished batches wait for the consumer, so memory stays
+    constant however many files are scanned (no Future per file). A task
+    is one file, or a batch of consecutive small files (SMALL_FILE_BYTES,
+    HASH_BATCH_FILES) hashed back to back by one worker.
+    
+    Yields:
+        (path, stat, digest, None) on success or (path, stat, None,
+        exception), in completion order
+    """
+    todo: queue.Queue = queue.Queue(maxsize=workers * 4)
+    done: queue.Queue = queue.Queue(maxsize=workers * 4)
+    stop = threading.Event()
+    
+    def feed():
+        try:
+            batch = []
+            for item in files:
+                if item[1].st_size >= SMALL_FILE_BYTES:
+                    todo.put([item])
+                else:
+                    batch.append(item)
+                    if len(batch) >= HASH_BATCH_FILES:
+                        todo.put(batch)
+                        batch = []
+                if stop.is_set():
+                    break
+            else:
+                if batch:
+                    todo.put(batch)
+        finally:
+            for _ in range(workers):
+                todo.put(None)
+    
+    def work():
+        while True:
+            batch = todo.get()
+            if batch is None:
+                done.put(None)
+                return
+            if stop.is_set():
+                continue  # Abandoned; keep draining so feed() can finish
+            out = []
+            for p, st in batch:
+                try:
+                    out.append((p, st, hash_fn(p), None))
+                except Exception as e:
+                    out.append((p, st, None, e))
+            done.put(out)
+    
+    threads = [threading.Thread(target=feed, name="hash-feed", daemon=True)]
+    threads += [threading.Thread(target=work, name=f"hash-{i}", daemon=True)
+                for i in range(workers)]
+    for t in threads:
+        t.start()
+    
+    running = workers
+    try:
+        while running:
+            out = done.get()
+            if out is None:
+                running -= 1
+            else:
+                yield from out
+    finally:
+        stop.set()
+        # Drain so workers blocked on a full done queue can reach their
+        # end-of-work marker (each worker sends exactly one)
+        while running:
+            if done.get() is None:
+                running -= 1
+        for t in threads:
+            t.join()
+
+
+def _hash_in_pool(pool: ProcessPoolExecutor, hash_fn: Callable[[Path], str],
+                  p: Path) -> str:
+    """Run hash_fn for one path in a worker process (str crosses the pickle)."""
+    return pool.submit(hash_fn, str(p)).result()
+
+
+def _print_progress(processed: int, total: int):
+    """Print one text progress line to stderr."""
+    percent = 100 * processed / total if total else 100.0
+    print(f"[scanner] Progress: {processed}/{total} ({percent:.1f}%)...",
+          file=sys.stderr)
+
+
+def threaded_hash_stream(roots: Iterable[str], ignore: Union[List[str], IgnoreMatcher],
+                         workers: int = 4, size_prefilter: bool = False,
+                         hash_fn: Callable[[Path], str] = sha256_file,
+                         use_processes: bool = False, hash_cache=None,
+                         partial_prefilter: bool = False,
+                         stats: Optional[dict] = None, db=None
+                         ) -> Iterator[Tuple[str, int, int, str, str, str]]:
+    """
+    Scan files and compute hashes with progress indicators, yielding each
+    result as soon as it is ready.
     
     Features:
-    - Parallel hashing with ThreadPoolExecutor
+    - Parallel hashing on worker threads fed by a bounded queue
     - Progress bar with tqdm (if available) or text fallback
     - MIME type detection
     - Context detection (archived vs unarchived)
     
+    Results are not collected, so a consumer that writes records out as
+    they arrive (e.g. DB.upsert_files) holds none of them. The walk's
+    (path, stat) list is still built up front: the prefilters and the
+    progress total need every file before hashing starts.
+    
     Args:
         roots: List of root directories to scan
-        ignore: List of directory/file patterns to skip
+        ignore: Directory/file names or glob patterns to skip (matched
+            per path component), or a matcher from compile_ignore()
         workers: Number of parallel worker threads
-        
-    Returns:
-        Tuple of (results, duration, total_files)
-        where results is List[Tuple[path, size, mtime, sha256, mime, context_tag]]
+        size_prefilter: If True, hash only files whose size is shared with
+            another scanned file (or, given db, with a row already in the
+            database); the rest get an UNHASHED_PREFIX placeholder digest
+        hash_fn: File hashing function, see hashing.select_content_hash;
+            must be a module-level function when use_processes is set
+        use_processes: Hash in worker processes instead of threads, for
+            CPUs where SHA-256 (not I/O) is the bottleneck; each file
+            costs an IPC round trip, so this does not pay off for small files
+        hash_cache: Optional db.HashCache; files it vouches for are not
+            read, and fresh digests are stored into it
+        partial_prefilter: With size_prefilter, also compare the first and
+            last 64 KiB of same-size files and fully hash only those whose
+            (size, partial signature) is shared; the rest get an
+            UNHASHED_PREFIX placeholder that includes the signature.
+            With SHA-256, files up to 128 KiB are fully covered by the
+            signature, which becomes their digest
+        stats: Optional dict, filled in once the stream is exhausted with
+            "files" (files found), "bytes" (total size of yielded records)
+            and "duration" (seconds, excluding the directory walk)
+        db: Optional db.DB the results go into; with size_prefilter its
+            rows from earlier scans count toward size uniqueness, and
+            placeholder rows whose size this scan now shares are re-hashed
+            and yielded too. Without it, uniqueness is only within this
+            scan, which is only safe for a database holding nothing else
+    
+    Yields:
+        Tuple[path, size, mtime, sha256, mime, context_tag] per file, in
+        completion order
     """
-    files = list(iter_files(roots, ignore))
-    results: List[Tuple[str, int, int, str, str, str]] = []
+    _clear_context_cache()
+    files = _stat_files(roots, ignore)
+    n_files = len(files)
+    n_bytes = 0
     start = time.time()
     
     # Check for tqdm availability
     has_tqdm = check_dep("tqdm")
     
-    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
-        futs = {}
-        for p in files:
-            futs[ex.submit(_sha256_file, p)] = p
-        
+    workers = max(1, workers)
+    to_hash = files
+    del files
+    # Sizes of files outside to_hash (other database rows, cache hits);
+    # neither prefilter can rule these out
+    known_sizes = Counter()
+    if size_prefilter and db is not None:
+        counts, stale = db.size_collisions(
+            (str(p), st.st_size) for p, st in to_hash
+        )
+        known_sizes.update(counts)
+        # Placeholder rows from earlier scans whose size is no longer unique
+        for path in stale:
+            try:
+                to_hash.append((Path(path), os.stat(path)))
+            except OSError:
+                continue  # Gone since; its row is left as it was
+        n_files = len(to_hash)
+    if hash_cache is not None:
+        # Before the size prefilter, so every scanned file is looked up
+        # (and its entry kept) and cache hits keep their real digest
+        to_hash, ready = _split_cached(to_hash, hash_cache)
+        known_sizes.update(rec[1] for rec in ready)
+        for rec in ready:
+            n_bytes += rec[1]
+            yield rec
+    if size_prefilter:
+        to_hash, ready = _size_prefilter(to_hash, known_sizes)
+        for rec in ready:
+            n_bytes += rec[1]
+            yield rec
+    if size_prefilter and partial_prefilter:
+        to_hash, ready = _partial_prefilter(to_hash, workers, frozenset(known_sizes),
+                                            hash_fn is sha256_file, hash_cache)
+        for rec in ready:
+            n_bytes += rec[1]
+            yield rec
+    ready = None
+    total = len(to_hash)
+    
+    pool = None
+    if use_processes and total:
+        # The pipeline threads just wait on the pool, one file each, which
+        # keeps the bounded in-flight window. Its processes start lazily
+        # from those threads, so they must not be forked (fork with
+        # threads holding locks can deadlock)
+        methods = multiprocessing.get_all_start_methods()
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            ),
+            initializer=init_deps,
+            initargs=(False, True)
+        )
+        hash_fn = functools.partial(_hash_in_pool, pool, hash_fn)
+    hashed = _hash_pipeline(to_hash, hash_fn, workers)
+    
+    try:
         # Progress tracking
         if has_tqdm:
             # Use tqdm progress bar
             from tqdm import tqdm
             
             pbar = tqdm(
-                total=len(futs),
+                total=total,
                 desc="Hashing files",
                 unit="file",
                 unit_scale=False,
-                ncols=80
+                ncols=80,
+                miniters=max(1, total // 200)  # Redraw at most ~200 times
             )
             
-            for fut in as_completed(futs):
-                p = futs[fut]
+            for p, st, sha, err in hashed:
+                rec = None
                 try:
-                    sha = fut.result()
-                    st = p.stat()
+                    if err is not None:
+                        raise err
                     mime = _get_mime_safe(p)
                     context = _detect_context(p)
-                    results.append((
+                    rec = (
                         str(p),
                         st.st_size,
                         int(st.st_mtime),
                         sha,
                         mime,
                         context
-                    ))
+                    )
+                    if hash_cache is not None:
+                        hash_cache.store(rec[0], st, sha)
                 except Exception as e:
                     # Log error but continue
                     print(f"[scanner][WARN] Failed to process {p}: {e}", file=sys.stderr)
                 finally:
                     pbar.update(1)
+                if rec is not None:
+                    n_bytes += rec[1]
+                    yield rec
             
             pbar.close()
         
         else:
-            # Fallback: text-based progress updates
-            processed = 0
-            last_update = 0
-            update_interval = max(1, len(futs) // 100)  # Update every 1%
+            # Fallback: text-based progress updates from a reporter thread,
+            # so the result loop only bumps a counter
+            processed = [0]
+            finished = threading.Event()
             
-            print(f"[scanner] Processing {len(futs)} files (no tqdm, using text updates)...", 
+            def report():
+                while not finished.wait(PROGRESS_INTERVAL):
+                    _print_progress(processed[0], total)
+            
+            print(f"[scanner] Processing {total} files (no tqdm, using text updates)...", 
                   file=sys.stderr)
+            reporter = threading.Thread(target=report, name="scan-progress", daemon=True)
+            reporter.start()
             
-            for fut in as_completed(futs):
-                p = futs[fut]
-                try:
-                    sha = fut.result()
-                    st = p.stat()
-                    mime = _get_mime_safe(p)
-                    context = _detect_context(p)
-                    results.append((
-                        str(p),
-                        st.st_size,
-                        int(st.st_mtime),
-                        sha,
-                        mime,
-                        context
-                    ))
-                except Exception as e:
-                    print(f"[scanner][WARN] Failed to process {p}: {e}", file=sys.stderr)
-                finally:
-                    processed += 1
-                    
-                    # Print periodic updates
-                    if processed - last_update >= update_interval or processed == len(futs):
-                        percent = 100 * processed / len(futs)
-                        print(
-                            f"[scanner] Progress: {processed}/{len(futs)} "
-                            f"({percent:.1f}%)...",
-                            file=sys.stderr
+            try:
+                for p, st, sha, err in hashed:
+                    rec = None
+                    try:
+                        if err is not None:
+                            raise err
+                        mime = _get_mime_safe(p)
+                        context = _detect_context(p)
+                        rec = (
+                            str(p),
+                            st.st_size,
+                            int(st.st_mtime),
+                            sha,
+                            mime,
+                            context
                         )
-                        last_update = processed
+                        if hash_cache is not None:
+                            hash_cache.store(rec[0], st, sha)
+                    except Exception as e:
+                        print(f"[scanner][WARN] Failed to process {p}: {e}", file=sys.stderr)
+                    finally:
+                        processed[0] += 1
+                    if rec is not None:
+                        n_bytes += rec[1]
+                        yield rec
+            finally:
+                finished.set()
+                reporter.join()
+            
+            if total:
+                _print_progress(processed[0], total)
+    finally:
+        hashed.close()
+        if pool is not None:
+            pool.shutdown()
     
-    dur = time.time() - start
-    return results, dur, len(files)
\ No newline at end of file
+    if stats is not None:
+        stats.update(files=n_files, bytes=n_bytes, duration=time.time() - start)
+
+
+def threaded_hash(roots: Iterable[str], ignore: Union[List[str], IgnoreMatcher],
+                  workers: int = 4, size_prefilter: bool = False,
+                  hash_fn: Callable[[Path], str] = sha256_file,
+                  use_processes: bool = False, hash_cache=None,
+                  partial_prefilter: bool = False, db=None):
+    """
+    Scan files and compute hashes, collecting all results.
+    
+    List-returning wrapper around threaded_hash_stream (same arguments).
+    
+    Returns:
+        Tuple of (results, duration, total_files)
+        where results is List[Tuple[path, size, mtime, sha256, mime, context_tag]]
+    """
+    stats = {}
+    results = list(threaded_hash_stream(
+        roots, ignore, workers, size_prefilter, hash_fn,
+        use_processes, hash_cache, partial_prefilter, stats, db
+    ))
+    return results, stats["duration"], stats["files"]
\ No newline at end of file
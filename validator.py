@@ -1,13 +1,19 @@
 # SPDX-License-Identifier: Apache-2.0
 # Copyright (c) 2025 Allaun
 
-import json
+import functools
 from pathlib import Path
 from .deps import check_dep
+from .jsonutil import loads
+
+
+# Keys every meta.json entry must carry (tuple keeps error messages ordered)
+ENTRY_KEYS = ("name", "size", "sha256", "mime", "category")
+_ENTRY_KEY_SET = frozenset(ENTRY_KEYS)
 
 
 def _load_schema(schema_path: Path):
-    return json.loads(schema_path.read_text(encoding="utf-8"))
+    return loads(schema_path.read_bytes())
 
 
 def get_schema(name: str):
@@ -31,6 +37,13 @@ def get_schema(name: str):
     return _load_schema(p)
 
 
+@functools.lru_cache(maxsize=8)
+def _get_validator(spec: str):
+    """Compiled jsonschema validator for a spec, built once per process."""
+    from jsonschema import Draft202012Validator
+    return Draft202012Validator(get_schema(spec))
+
+
 def validate_meta_dict(meta: dict):
     """
     Validate metadata dictionary against schema.
@@ -48,8 +61,7 @@ def validate_meta_dict(meta: dict):
     # Try jsonschema validation
     if check_dep("jsonschema"):
         try:
-            from jsonschema import Draft202012Validator
-            Draft202012Validator(get_schema(spec)).validate(meta)
+            _get_validator(spec).validate(meta)
             return True, None
         except Exception as e:
             return False, str(e)
@@ -67,12 +79,18 @@ def validate_meta_dict(meta: dict):
         # Validate entries structure
         for entry in meta["entries"]:
             assert isinstance(entry, dict), "entry must be object"
-            for k in ("name", "size", "sha256", "mime", "category"):
-                assert k in entry, f"entry missing key: {k}"
+            if not _ENTRY_KEY_SET.issubset(entry):
+                missing = next(k for k in ENTRY_KEYS if k not in entry)
+                raise AssertionError(f"entry missing key: {missing}")
             
-            # Validate sha256 format
-            assert len(entry["sha256"]) == 64, "sha256 must be 64 chars"
-            assert all(c in "0123456789abcdefABCDEF" for c in entry["sha256"]), "sha256 must be hex"
+            # Validate sha256 format (fromhex checks every digit in C; a
+            # 64-char string only yields 32 bytes if it has no whitespace)
+            sha = entry["sha256"]
+            assert len(sha) == 64, "sha256 must be 64 chars"
+            try:
+                assert len(bytes.fromhex(sha)) == 32, "sha256 must be hex"
+            except ValueError:
+                raise AssertionError("sha256 must be hex")
         
         return True, None
         